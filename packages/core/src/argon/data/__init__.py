@@ -6,23 +6,32 @@ import argon.tree
 import argon.graph
 import argon.random
 import argon.typing as atp
+import argon.data.profile as profile
 
 from argon.struct import struct, replace
 from argon.typing import ArrayLike
 
-from contextlib import contextmanager
+from contextlib import contextmanager, ExitStack
 from typing import (
     TypeVar, Generic, Callable, Sequence,
-    Generator
+    Generator, Any
 )
 
 import jax
+import jax.interpreters.partial_eval as pe
 
 import math
+import time
+import dataclasses
+import functools
+import queue
+import threading
 import numpy as np
 
 T = TypeVar('T')
 V = TypeVar('V')
+S = TypeVar('S')
+R = TypeVar('R')
 
 # Make indices 64-bit if x64 is enabled
 idx_dtype = int
@@ -36,6 +45,12 @@ class DataStream(Generic[T]):
 
     def reset(self):
         raise NotImplementedError()
+
+    # A pytree capturing the position of the stream
+    # (serializable with argon.store.dump), from which
+    # StreamBuilder.build(resume_from=...) continues.
+    def state(self) -> Any:
+        raise NotImplementedError()
     
     def map(self, fn: Callable[[T], V]) -> DataStream[V]:
         return MappedStream(self, fn)
@@ -44,14 +59,59 @@ class StreamBuilder(Generic[T]):
     def batch(self, batch_size: int) -> StreamBuilder[T]:
         raise NotImplementedError()
     
-    def shuffle(self, rng_key: jax.Array, resample=False) -> StreamBuilder[T]:
+    # If lazy, the shuffled order is computed on the fly from a
+    # keyed bijection instead of materializing a permutation of the data.
+    def shuffle(self, rng_key: jax.Array, resample=False, lazy=False) -> StreamBuilder[T]:
         raise NotImplementedError()
     
+    # Sample elements with replacement, proportionally to weights.
+    def weighted(self, weights: ArrayLike, rng_key: jax.Array | None = None) -> StreamBuilder[T]:
+        raise NotImplementedError()
+
     def map(self, fn: Callable[[T], V]) -> StreamBuilder[V]:
         return MappedStreamBuilder(self, fn)
+
+    # Apply a host-side python function (e.g. image decoding,
+    # tokenization) in a pool of worker processes. The function
+    # must be picklable. If batched, fn receives a shard of the batch
+    # rather than individual elements. The output order is deterministic.
+    def parallel_map(self, fn: Callable[[T], V], workers: int,
+                     batched: bool = False) -> StreamBuilder[V]:
+        from argon.data.parallel import ParallelMapStreamBuilder
+        return ParallelMapStreamBuilder(self, fn, workers, batched)
+
+    # Approximately shuffle the (batched) stream through a device-resident
+    # buffer of size elements. Unlike shuffle(), this does not
+    # require random access to the underlying data.
+    def shuffle_buffer(self, size: int, rng_key: jax.Array) -> StreamBuilder[T]:
+        from argon.data.shuffle import ShuffleBufferStreamBuilder
+        return ShuffleBufferStreamBuilder(self, size, rng_key)
+
+    # Fetch up to n batches ahead on a background thread,
+    # placing them on the given device (or the default device).
+    def prefetch(self, n: int = 2, device: jax.Device | None = None) -> StreamBuilder[T]:
+        return PrefetchStreamBuilder(self, n, device)
     
+    # Reduce all batches of one pass over the stream.
+    def reduce(self, reducer: "Reducer[T, S, R]") -> R:
+        state = None
+        with self.build() as stream:
+            while stream.has_next():
+                batch = stream.next()
+                if state is None:
+                    state = reducer.init(argon.tree.map(
+                        lambda x: jax.ShapeDtypeStruct(x.shape[1:], x.dtype), batch
+                    ))
+                state = _reduce_batch(reducer, state, batch)
+        if state is None:
+            raise ValueError("Cannot reduce an empty stream")
+        return reducer.finalize(state)
+
+    # If resume_from is given (a DataStream.state() of a stream
+    # built from an equivalent builder), the stream continues
+    # from that position rather than from the start.
     @contextmanager
-    def build(self) -> Generator[DataStream[T], None, None]:
+    def build(self, resume_from: Any = None) -> Generator[DataStream[T], None, None]:
         raise NotImplementedError()
 
 class Data(Generic[T]):
@@ -66,6 +126,21 @@ class Data(Generic[T]):
 
     def __getitem__(self, idx : ArrayLike) -> T:
         raise NotImplementedError()
+
+    # Gather a batch of elements. The result has
+    # leading axes matching the shape of idxs.
+    # Backends which can serve a whole batch at once
+    # (e.g. a single host read) should override this.
+    def gather(self, idxs : ArrayLike) -> T:
+        idxs = npx.asarray(idxs, dtype=idx_dtype)
+        flat = jax.vmap(lambda i: self[i])(npx.reshape(idxs, (-1,)))
+        return _unflatten_batch(flat, idxs.shape)
+
+    # Like gather(), but only the elements where mask is true are
+    # used (the others may have any value). Backends for which reading
+    # is expensive (e.g. from disk) should skip the other elements.
+    def gather_masked(self, idxs : ArrayLike, mask : jax.Array) -> T:
+        return self.gather(idxs)
     
     def stream(self) -> StreamBuilder[T]:
         return IndexedStreamBuilder(self, len(self))
@@ -76,30 +151,207 @@ class Data(Generic[T]):
         return argon.tree.map(lambda x: jax.ShapeDtypeStruct(x.shape, x.dtype), self[0])
 
     def as_pytree(self) -> T:
-        idxs = npx.arange(len(self), dtype=idx_dtype)
-        return jax.vmap(lambda i: self[i])(idxs)
+        return self.gather(npx.arange(len(self), dtype=idx_dtype))
 
     def slice(self, off : ArrayLike, length : ArrayLike) -> "Data[T]":
         length = np.array(length).item()
         length = length or len(self) - off
         idxs = npx.arange(length, dtype=idx_dtype) + off
-        return PyTreeData(jax.vmap(lambda i: self[i])(idxs))
+        return PyTreeData(self.gather(idxs))
 
     def map(self, fn : Callable[[T], V]) -> "MappedData[V]":
+        # backends which support projection only
+        # read the leaves that fn depends on
+        if type(self).project is not Data.project:
+            return MappedData(self.project(_used_leaves(fn, self.structure)), fn)
         return MappedData(self, fn)
 
-    # "caching" data realizes any transformations
-    def cache(self) -> "PyTreeData[T]":
-        return PyTreeData(self.as_pytree())
-    
+    # Keep only the given fields (of a dict or struct) of each element,
+    # the other (struct) fields are set to None. Lazy backends do not
+    # read the leaves of dropped fields.
+    def select(self, fields : Sequence[str]) -> "Data":
+        return self.map(functools.partial(_select, fields=tuple(fields)))
+
+    # A pytree of bools (matching the structure) of the leaves which
+    # are needed, lazy backends may skip reading the other leaves.
+    # The unused leaves are then filled with zeros.
+    def project(self, used : T) -> "Data[T]":
+        return self
+
+    # A view of the elements for which pred is true.
+    # The predicate is evaluated once, chunk_size elements at a time,
+    # and only a compact index map is stored.
+    def filter(self, pred : Callable[[T], bool], chunk_size : int = 4096) -> "SubsetData[T]":
+        mask = np.concatenate([np.zeros((0,), dtype=bool)] + [
+            np.asarray(m, dtype=bool) for m in _map_chunked(self, pred, chunk_size)
+        ])
+        indices = np.nonzero(mask)[0]
+        return SubsetData(self, npx.array(indices, dtype=npx.int32))
+
+    # A (zero-copy) view of this data followed by other.
+    def append(self, other : "Data[T]") -> "ConcatData[T]":
+        datas = self.datas if isinstance(self, ConcatData) else (self,)
+        others = other.datas if isinstance(other, ConcatData) else (other,)
+        datas = tuple(datas) + tuple(others)
+        # empty children are dropped, but one is kept for the structure
+        return ConcatData(tuple(d for d in datas if len(d) > 0) or datas[:1])
+
+    # Cache realized elements in a host-side LRU cache of
+    # at most max_bytes, e.g. to avoid re-decoding images every epoch.
+    def memoize(self, max_bytes: int) -> "Data[T]":
+        from argon.data.host import ElementCache, MemoizedData
+        return MemoizedData(ElementCache(self, max_bytes))
+
+    # "caching" data realizes any transformations.
+    # If a chunk_size is given, the data is materialized chunk_size
+    # elements at a time into a preallocated output, so that peak
+    # memory depends on the chunk size rather than the dataset size.
+    # The output is placed on the given device (e.g. a cpu device
+    # to keep the materialized data in host memory).
+    def cache(self, chunk_size: int | None = None,
+              device: jax.Device | None = None) -> "PyTreeData[T]":
+        if chunk_size is None:
+            tree = self.as_pytree()
+            if device is not None:
+                tree = jax.device_put(tree, device)
+            return PyTreeData(tree)
+        return PyTreeData(_materialize_chunked(self, chunk_size, device))
+
+    # Materializes the data into host memory, chunk_size elements
+    # at a time. Batches of the result are gathered on the host and
+    # only the batch is transferred to the device, so datasets larger
+    # than device memory remain trainable. Use stream().prefetch()
+    # to overlap the transfer with compute.
+    def to_host(self, chunk_size: int | None = None) -> "HostData[T]":
+        from argon.data.host import to_host
+        return to_host(self, chunk_size)
+
+    # Compute the elements (chunk_size at a time) into a zarr directory
+    # at path, tagged with a hash of the pipeline definition (function code,
+    # the globals it references and static values) and key. If path already
+    # holds data with the same hash, it is opened lazily rather than recomputed.
+    # Small arrays and a sample of the computed elements are hashed by
+    # contents, library functions only by name.
+    def persist(self, path, key : Any = None, chunk_size : int = 4096) -> "ZarrData[T]":
+        from argon.data.host import persist
+        return persist(self, path, key, chunk_size)
+
+    # Reduce over all elements, chunk_size elements at a time,
+    # without materializing the data. See argon.data.reduce.
+    def reduce(self, reducer : "Reducer[T, S, R]", chunk_size : int = 4096) -> R:
+        n = len(self)
+        state = reducer.init(self.structure)
+        if n == 0:
+            return reducer.finalize(state)
+        chunk_size = min(chunk_size, n)
+        length = npx.array(n, dtype=idx_dtype)
+        for off in range(0, n, chunk_size):
+            # the last chunk is padded and masked (rather than
+            # overlapped) so no element is counted twice
+            state = _reduce_chunk(reducer, state, self,
+                npx.array(off, dtype=idx_dtype), length, chunk_size)
+        return reducer.finalize(state)
+
+    # The count, mean, variance, min and max of every component.
+    def statistics(self, chunk_size : int = 4096) -> "Statistics[T]":
+        from argon.data.reduce import StatisticsReducer
+        return self.reduce(StatisticsReducer(), chunk_size)
+
+@agt.jit(static_argnums=(5,))
+def _reduce_chunk(reducer, state, data : Data[T], off : jax.Array,
+                  length : jax.Array, chunk_size : int):
+    idxs = off + npx.arange(chunk_size, dtype=idx_dtype)
+    mask = idxs < length
+    batch = data.gather(npx.minimum(idxs, length - 1))
+    return reducer.update(state, batch, mask)
+
 @agt.jit
-def _compute_mapped_structure(fn, data_structure : T) -> T:
-    sample = argon.tree.map(lambda x: npx.zeros(x.shape, x.type), data_structure)
-    mapped = fn(sample)
+def _reduce_batch(reducer, state, batch):
+    n = argon.tree.leaves(batch)[0].shape[0]
+    return reducer.update(state, batch, npx.ones((n,), dtype=bool))
+
+@agt.jit(static_argnums=(2,))
+def _gather_chunk(data : Data[T], off : jax.Array, chunk_size : int) -> T:
+    return data.gather(off + npx.arange(chunk_size, dtype=idx_dtype))
+
+@agt.jit(static_argnums=(2,3))
+def _map_chunk(data : Data[T], off : jax.Array, chunk_size : int,
+               fn : Callable[[T], V]) -> V:
+    return jax.vmap(fn)(data.gather(off + npx.arange(chunk_size, dtype=idx_dtype)))
+
+# Applies fn to every element, chunk_size elements at a time,
+# yielding the results for consecutive (non-overlapping) chunks.
+def _map_chunked(data : Data[T], fn : Callable[[T], V],
+                 chunk_size : int) -> Generator[V, None, None]:
+    n = len(data)
+    if n == 0:
+        return
+    chunk_size = min(chunk_size, n)
+    for off in range(0, n, chunk_size):
+        # the last chunk overlaps the previous one
+        # so that all chunks use the same kernel
+        start = min(off, n - chunk_size)
+        result = _map_chunk(data, npx.array(start, dtype=idx_dtype), chunk_size, fn)
+        yield argon.tree.map(lambda x: x[off - start:], result)
+
+@functools.partial(jax.jit, donate_argnums=(0,))
+def _write_chunk(out : T, chunk : T, off : jax.Array) -> T:
+    return argon.tree.map(
+        lambda o, c: jax.lax.dynamic_update_slice_in_dim(o, c.astype(o.dtype), off, axis=0),
+        out, chunk
+    )
+
+def _materialize_chunked(data : Data[T], chunk_size : int,
+                         device : jax.Device | None = None) -> T:
+    n = len(data)
+    out = argon.tree.map(
+        lambda s: npx.zeros((n,) + s.shape, s.dtype, device=device),
+        data.structure
+    )
+    if n == 0:
+        return out
+    chunk_size = min(chunk_size, n)
+    for off in range(0, n, chunk_size):
+        # The last chunk overlaps with the previous one
+        # so that every chunk has the same shape and
+        # all go through the same compiled kernel.
+        off = npx.array(min(off, n - chunk_size), dtype=idx_dtype)
+        chunk = _gather_chunk(data, off, chunk_size)
+        if device is not None:
+            chunk = jax.device_put(chunk, device)
+            off = jax.device_put(off, device)
+        out = _write_chunk(out, chunk, off)
+    return out
+    
+def _flatten_batch(tree, batch_shape):
+    return argon.tree.map(
+        lambda x: npx.reshape(x, (-1,) + x.shape[len(batch_shape):]),
+        tree
+    )
+
+def _unflatten_batch(tree, batch_shape):
     return argon.tree.map(
-        lambda x: jax.ShapeDtypeStruct(x.shape, x.dtype), mapped
+        lambda x: npx.reshape(x, tuple(batch_shape) + x.shape[1:]),
+        tree
     )
 
+def _select(x, fields : tuple[str, ...]):
+    if isinstance(x, dict):
+        return {k: x[k] for k in fields}
+    return replace(x, **{f.name: None for f in dataclasses.fields(x)
+                         if f.name not in fields})
+
+# Which leaves of the structure fn depends on,
+# found by dead code elimination of its jaxpr.
+def _used_leaves(fn : Callable[[T], V], structure : T) -> T:
+    leaves, treedef = jax.tree.flatten(structure)
+    closed = jax.make_jaxpr(lambda leaves: fn(jax.tree.unflatten(treedef, leaves)))(leaves)
+    _, used = pe.dce_jaxpr(closed.jaxpr, [True]*len(closed.jaxpr.outvars))
+    return jax.tree.unflatten(treedef, used)
+
+def _compute_mapped_structure(fn, data_structure : T) -> T:
+    return jax.eval_shape(fn, data_structure)
+
 @struct(frozen=True)
 class MappedData(Data[T]):
     data : Data[V]
@@ -109,6 +361,14 @@ class MappedData(Data[T]):
         return len(self.data)
     def __getitem__(self, idx : ArrayLike) -> T:
         return self.fn(self.data[idx])
+    def gather(self, idxs : ArrayLike) -> T:
+        idxs = npx.asarray(idxs, dtype=idx_dtype)
+        data = _flatten_batch(self.data.gather(idxs), idxs.shape)
+        return _unflatten_batch(agt.vmap(self.fn)(data), idxs.shape)
+    def gather_masked(self, idxs : ArrayLike, mask : jax.Array) -> T:
+        idxs = npx.asarray(idxs, dtype=idx_dtype)
+        data = _flatten_batch(self.data.gather_masked(idxs, mask), idxs.shape)
+        return _unflatten_batch(agt.vmap(self.fn)(data), idxs.shape)
     def stream(self) -> StreamBuilder[T]:
         return self.data.stream().map(self.fn)
 
@@ -123,6 +383,25 @@ class MappedData(Data[T]):
     def slice(self, off : ArrayLike, length : ArrayLike) -> T:
         return self.data.slice(off, length).map(self.fn)
 
+    # Compose with the existing map, so that
+    # the backend sees all the functions at once.
+    def map(self, fn : Callable[[T], V]) -> "MappedData[V]":
+        first = self.fn
+        def composed(x):
+            return fn(first(x))
+        return self.data.map(composed)
+
+# Applies fn to each element of a batch with batch_shape leading axes.
+def _apply_elements(fn : Callable[[V], T], batch : V, batch_shape : tuple[int, ...]) -> T:
+    batch = _flatten_batch(batch, batch_shape)
+    return _unflatten_batch(jax.vmap(fn)(batch), batch_shape)
+
+_map_elements = agt.jit(_apply_elements, static_argnums=(0, 2))
+
+@agt.jit(static_argnums=(0,))
+def _map_batch(fn : Callable[[V], T], batch : V) -> T:
+    return jax.vmap(fn)(batch)
+
 @struct
 class MappedStream(DataStream[T]):
     stream: DataStream[V]
@@ -136,12 +415,16 @@ class MappedStream(DataStream[T]):
 
     def next(self):
         batch = self.stream.next()
-        batch = jax.vmap(self.fn)(batch)
+        batch = profile.stage(profile.stage_name("map", self.fn),
+                              _map_batch, self.fn, batch)
         return batch
 
     def reset(self):
         return self.stream.reset()
 
+    def state(self) -> Any:
+        return self.stream.state()
+
 @struct(frozen=True)
 class MappedStreamBuilder(StreamBuilder[T]):
     builder: StreamBuilder[V]
@@ -150,16 +433,350 @@ class MappedStreamBuilder(StreamBuilder[T]):
     def batch(self, batch_size: int) -> "MappedStreamBuilder[T]":
         return MappedStreamBuilder(self.builder.batch(batch_size), self.fn)
     
-    def shuffle(self, rng_key : jax.Array, resample=False) -> "MappedStreamBuilder[T]":
+    def shuffle(self, rng_key : jax.Array, resample=False, lazy=False) -> "MappedStreamBuilder[T]":
         return MappedStreamBuilder(
-            self.builder.shuffle(rng_key, resample), self.fn
+            self.builder.shuffle(rng_key, resample, lazy), self.fn
+        )
+
+    def weighted(self, weights : ArrayLike, rng_key : jax.Array | None = None) -> "MappedStreamBuilder[T]":
+        return MappedStreamBuilder(
+            self.builder.weighted(weights, rng_key), self.fn
         )
 
     @contextmanager
-    def build(self) -> Generator[DataStream[T], None, None]:
-        with self.builder.build() as stream:
+    def build(self, resume_from: Any = None) -> Generator[DataStream[T], None, None]:
+        with self.builder.build(resume_from) as stream:
             yield MappedStream(stream, self.fn)
 
+# A view of several Data (with the same structure) one after the other.
+# Indices are routed to the children using a table of offsets.
+@struct(frozen=True)
+class ConcatData(Data[T]):
+    datas: Sequence[Data[T]]
+
+    @property
+    def offsets(self) -> tuple[int, ...]:
+        return tuple(int(o) for o in np.cumsum([0] + [len(d) for d in self.datas]))
+
+    def __len__(self) -> int:
+        return self.offsets[-1]
+
+    def __getitem__(self, idx : ArrayLike) -> T:
+        idx = npx.asarray(idx, dtype=idx_dtype)
+        assert idx.ndim == 0
+        return self.gather(idx)
+
+    def gather(self, idxs : ArrayLike) -> T:
+        idxs = npx.asarray(idxs, dtype=idx_dtype)
+        return self.gather_masked(idxs, npx.ones(idxs.shape, dtype=bool))
+
+    # Each child serves all of the (clamped) indices and the values of
+    # the child which owns each index are selected, so a gather costs
+    # as much as one on every child. Children for which reading is
+    # expensive (see gather_masked()) only read the rows they own.
+    def gather_masked(self, idxs : ArrayLike, mask : jax.Array) -> T:
+        idxs = npx.asarray(idxs, dtype=idx_dtype)
+        offsets = self.offsets
+        if len(self.datas) == 1:
+            return self.datas[0].gather_masked(idxs, mask)
+        child = npx.searchsorted(
+            npx.array(offsets[1:-1], dtype=idx_dtype), idxs, side="right"
+        )
+        result = None
+        for i, (data, off) in enumerate(zip(self.datas, offsets)):
+            # never owns an index (and cannot be gathered from)
+            if len(data) == 0:
+                continue
+            local = npx.clip(idxs - off, 0, len(data) - 1)
+            values = data.gather_masked(local, mask & (child == i))
+            if result is None:
+                result = values
+            else:
+                result = argon.tree.map(
+                    lambda r, v: npx.where(
+                        npx.reshape(child == i, child.shape + (1,)*(v.ndim - child.ndim)),
+                        v, r
+                    ), result, values
+                )
+        return result
+
+    @property
+    def structure(self) -> T:
+        return self.datas[0].structure
+
+    # Only the overlapping children are kept (and sliced).
+    def slice(self, off : ArrayLike, length : ArrayLike) -> "Data[T]":
+        if isinstance(off, jax.core.Tracer):
+            return super().slice(off, length)
+        off, length = int(off), np.array(length).item()
+        length = length or len(self) - off
+        datas = []
+        for data, start in zip(self.datas, self.offsets):
+            lo, hi = max(off, start), min(off + length, start + len(data))
+            if hi > lo:
+                datas.append(data.slice(lo - start, hi - lo))
+        return ConcatData(tuple(datas)) if len(datas) != 1 else datas[0]
+
+    def project(self, used : T) -> "ConcatData[T]":
+        return ConcatData(tuple(d.project(used) for d in self.datas))
+
+@struct
+class MixtureStream(DataStream[T]):
+    streams: Sequence[DataStream[T]]
+
+    def __len__(self):
+        return min(len(s) for s in self.streams)
+
+    def has_next(self):
+        return all(s.has_next() for s in self.streams)
+
+    def next(self) -> T:
+        batches = [s.next() for s in self.streams]
+        return argon.tree.map(lambda *xs: npx.concatenate(xs, axis=0), *batches)
+
+    def reset(self):
+        for s in self.streams:
+            s.reset()
+
+    def state(self) -> tuple:
+        return tuple(s.state() for s in self.streams)
+
+# Draws batches from several streams with fixed ratios:
+# every batch contains (approximately) weights[i] / sum(weights)
+# elements from builders[i], concatenated along the batch axis.
+# The epoch ends when any of the streams is exhausted.
+@struct(frozen=True)
+class Mixture(StreamBuilder[T]):
+    builders: Sequence[StreamBuilder[T]]
+    weights: Sequence[float]
+    batch_size: int | None = None
+
+    def batch(self, batch_size: int) -> "Mixture[T]":
+        if self.batch_size is not None:
+            raise ValueError("Mixture streams only support a single batch axis")
+        return replace(self, batch_size=batch_size)
+
+    def shuffle(self, rng_key : jax.Array, resample=False, lazy=False) -> "Mixture[T]":
+        keys = jax.random.split(rng_key, len(self.builders))
+        return replace(self, builders=tuple(
+            b.shuffle(k, resample, lazy) for b, k in zip(self.builders, keys)
+        ))
+
+    def batch_sizes(self) -> list[int]:
+        # largest-remainder rounding of the per-stream shares
+        weights = np.asarray(self.weights, dtype=np.float64)
+        shares = self.batch_size * weights / np.sum(weights)
+        sizes = np.floor(shares).astype(int)
+        remainder = self.batch_size - np.sum(sizes)
+        sizes[np.argsort(sizes - shares)[:remainder]] += 1
+        return [int(s) for s in sizes]
+
+    @contextmanager
+    def build(self, resume_from: tuple | None = None) -> Generator[DataStream[T], None, None]:
+        if self.batch_size is None:
+            raise ValueError("Mixture streams must be batched")
+        if len(self.weights) != len(self.builders):
+            raise ValueError("Need one weight per stream")
+        builders = [
+            b.batch(size) for b, size in zip(self.builders, self.batch_sizes())
+            if size > 0
+        ]
+        states = resume_from if resume_from is not None else (None,)*len(builders)
+        if len(states) != len(builders):
+            raise ValueError(f"Expected a state for each of the {len(builders)} streams")
+        with ExitStack() as stack:
+            streams = [
+                stack.enter_context(b.build(state))
+                for b, state in zip(builders, states)
+            ]
+            yield MixtureStream(streams)
+
+# A view of the elements of data at the given indices.
+@struct(frozen=True)
+class SubsetData(Data[T]):
+    data: Data[T]
+    indices: jax.Array
+
+    def __len__(self) -> int:
+        return self.indices.shape[0]
+
+    def __getitem__(self, idx : ArrayLike) -> T:
+        return self.data[self.indices[idx]]
+
+    def gather(self, idxs : ArrayLike) -> T:
+        idxs = npx.asarray(idxs, dtype=idx_dtype)
+        return self.data.gather(self.indices[idxs])
+
+    def gather_masked(self, idxs : ArrayLike, mask : jax.Array) -> T:
+        idxs = npx.asarray(idxs, dtype=idx_dtype)
+        return self.data.gather_masked(self.indices[idxs], mask)
+
+    @property
+    def structure(self) -> T:
+        return self.data.structure
+
+    def slice(self, off : ArrayLike, length : ArrayLike) -> "SubsetData[T]":
+        if not isinstance(off, jax.Array):
+            off = int(off)
+        length = np.array(length).item()
+        # the length can only be clamped to
+        # the end of the view for a static offset
+        limit = len(self) - off if isinstance(off, int) else len(self)
+        length = min(length or limit, limit)
+        indices = jax.lax.dynamic_slice_in_dim(self.indices, off, length)
+        return SubsetData(self.data, indices)
+
+    def project(self, used : T) -> "SubsetData[T]":
+        return replace(self, data=self.data.project(used))
+
+# Queue markers used by the prefetching thread
+_END = object()
+
+class _WorkerError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+class PrefetchStream(DataStream[T]):
+    def __init__(self, stream: DataStream[T], size: int,
+                 device: jax.Device | None = None):
+        if size < 1:
+            raise ValueError(f"Prefetch size must be positive, got {size}")
+        self.stream = stream
+        self.size = size
+        self.device = device
+        self._queue = None
+        self._thread = None
+        self._stop = None
+        self._head = None
+        self._remaining = None
+        self._state = None
+        self._start()
+
+    def _stream_state(self):
+        try: return self.stream.state()
+        except NotImplementedError: return None
+
+    def _start(self):
+        try: self._remaining = int(len(self.stream))
+        except TypeError: self._remaining = None
+        self._state = self._stream_state()
+        # The queue holds at most size ready batches,
+        # the worker may additionally hold one in flight.
+        self._queue = queue.Queue(maxsize=self.size)
+        self._stop = threading.Event()
+        self._head = None
+        self._thread = threading.Thread(
+            target=self._run, args=(self._queue, self._stop),
+            name="argon-prefetch", daemon=True
+        )
+        self._thread.start()
+
+    def _put(self, q, stop, item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self, q, stop):
+        try:
+            while not stop.is_set() and self.stream.has_next():
+                batch = self.stream.next()
+                batch = profile.stage("transfer", jax.device_put, batch, self.device)
+                # make sure the batch is fully realized on this thread
+                batch = jax.block_until_ready(batch)
+                # the stream runs ahead of the consumer, so
+                # remember its state after each batch
+                if not self._put(q, stop, (batch, self._stream_state())):
+                    return
+        except BaseException as e:
+            self._put(q, stop, _WorkerError(e))
+            return
+        self._put(q, stop, _END)
+
+    def _stop_worker(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._head = None
+
+    def _peek(self):
+        if self._head is None:
+            t = time.perf_counter()
+            self._head = self._queue.get()
+            # time spent waiting on the prefetching thread
+            profile.record("prefetch_wait", time.perf_counter() - t)
+        if isinstance(self._head, _WorkerError):
+            error = self._head.error
+            self._head = _END
+            raise error
+        return self._head
+
+    def __len__(self):
+        if self._remaining is None:
+            raise TypeError("Underlying stream has no length")
+        return self._remaining
+
+    def has_next(self):
+        return self._peek() is not _END
+
+    def next(self) -> T:
+        item = self._peek()
+        if item is _END:
+            raise ValueError("Stream is exhausted, call reset()")
+        self._head = None
+        if self._remaining is not None:
+            self._remaining = self._remaining - 1
+        batch, self._state = item
+        return batch
+
+    def reset(self):
+        self._stop_worker()
+        self.stream.reset()
+        self._start()
+
+    # The state after the last consumed batch
+    # (not including batches which are prefetched).
+    def state(self) -> Any:
+        if self._state is None:
+            raise NotImplementedError("Underlying stream has no state")
+        return self._state
+
+    def close(self):
+        self._stop_worker()
+
+@struct(frozen=True)
+class PrefetchStreamBuilder(StreamBuilder[T]):
+    builder: StreamBuilder[T]
+    size: int
+    device: jax.Device | None = None
+
+    def batch(self, batch_size: int) -> "PrefetchStreamBuilder[T]":
+        return replace(self, builder=self.builder.batch(batch_size))
+
+    def shuffle(self, rng_key : jax.Array, resample=False, lazy=False) -> "PrefetchStreamBuilder[T]":
+        return replace(self, builder=self.builder.shuffle(rng_key, resample, lazy))
+
+    def weighted(self, weights : ArrayLike, rng_key : jax.Array | None = None) -> "PrefetchStreamBuilder[T]":
+        return replace(self, builder=self.builder.weighted(weights, rng_key))
+
+    # Run the map on the background thread as well
+    def map(self, fn: Callable[[T], V]) -> "PrefetchStreamBuilder[V]":
+        return replace(self, builder=self.builder.map(fn))
+
+    @contextmanager
+    def build(self, resume_from: Any = None) -> Generator[DataStream[T], None, None]:
+        with self.builder.build(resume_from) as stream:
+            stream = PrefetchStream(stream, self.size, self.device)
+            try:
+                yield stream
+            finally:
+                stream.close()
+
 # A Data backed by a jax pytree
 class PyTreeData(Data[T]):
     def __init__(self, tree: T | None = None):
@@ -188,6 +805,10 @@ class PyTreeData(Data[T]):
             self.tree
         )
 
+    def gather(self, idxs : ArrayLike) -> T:
+        idxs = npx.asarray(idxs, dtype=idx_dtype)
+        return argon.tree.map(lambda x: x[idxs], self.tree)
+
     @property
     def structure(self):
         return argon.tree.map(
@@ -195,25 +816,157 @@ class PyTreeData(Data[T]):
             self.tree
         )
 
-    def slice(self, off : ArrayLike, length : ArrayLike) -> T:
-        # the length must be a scalar
-        length = np.array(min(len(self), length)).item()
-        return PyTreeData(argon.tree.map(
-            lambda x: jax.lax.dynamic_slice(x,
-                    npx.broadcast_to(npx.array(off, dtype=idx_dtype), (x.ndim,)),
-                    (length,) + x.shape[1:]),
-            self.tree
-        ))
+    # A (zero-copy) view of length elements starting at off.
+    def slice(self, off : ArrayLike, length : ArrayLike) -> "PyTreeView[T]":
+        return PyTreeView(self.tree, 0, int(len(self))).slice(off, length)
+
+    # A (zero-copy) view of all windows of the given
+    # length, starting every stride elements.
+    def window(self, window : int, stride : int = 1) -> "PyTreeView[T]":
+        return PyTreeView(self.tree, 0, int(len(self))).window(window, stride)
     
     def as_pytree(self) -> T:
         return self.tree
 
+    def to_host(self, chunk_size: int | None = None) -> "HostData[T]":
+        from argon.data.host import HostData
+        return HostData.from_arrays(jax.device_get(self.tree))
+
+    # Store floating point leaves compressed, either quantized to
+    # "uint8" (with a per-component scale and offset), or as "float16"
+    # or "bfloat16", optionally delta-encoded with a keyframe every
+    # delta_block elements. dtype may also be a pytree prefix of
+    # per-leaf types, with None to store a leaf uncompressed.
+    # Decoding happens in gather(), fused into the batch fetch.
+    def compress(self, dtype="uint8", delta_block: int | None = None) -> "CompressedData[T]":
+        from argon.data.compressed import CompressedData, encode
+        leaves = jax.tree.map(
+            lambda d, subtree: argon.tree.map(lambda x: encode(x, d, delta_block), subtree),
+            dtype, jax.device_get(self.tree),
+            is_leaf=lambda x: x is None or isinstance(x, str)
+        )
+        return CompressedData(leaves)
+
 argon.graph.register_pytree_node_type(
     PyTreeData,
     lambda d: ((("tree", d.tree),), None),
     lambda c, _: PyTreeData(c[0][1])
 )
 
+# A view of (possibly windowed, strided) elements of a pytree.
+# Element i is tree[offset + i*stride], or the window
+# tree[offset + i*stride : offset + i*stride + window_length].
+# Nothing is copied until elements are gathered.
+@struct(frozen=True)
+class PyTreeView(Data[T]):
+    tree: T
+    offset: int | jax.Array
+    length: int
+    stride: int = 1
+    window_length: int | None = None
+
+    def __len__(self) -> int:
+        return self.length
+
+    def _indices(self, idxs : jax.Array) -> jax.Array:
+        idxs = self.offset + idxs * self.stride
+        if self.window_length is not None:
+            idxs = idxs[..., None] + npx.arange(self.window_length, dtype=idx_dtype)
+        return idxs
+
+    def __getitem__(self, idx : ArrayLike) -> T:
+        idx = npx.asarray(idx, dtype=idx_dtype)
+        assert idx.ndim == 0
+        return self.gather(idx)
+
+    def gather(self, idxs : ArrayLike) -> T:
+        idxs = self._indices(npx.asarray(idxs, dtype=idx_dtype))
+        return argon.tree.map(lambda x: x[idxs], self.tree)
+
+    @property
+    def structure(self) -> T:
+        prefix = (self.window_length,) if self.window_length is not None else ()
+        return argon.tree.map(
+            lambda x: atp.ShapeDtypeStruct(prefix + x.shape[1:], x.dtype),
+            self.tree
+        )
+
+    def slice(self, off : ArrayLike, length : ArrayLike) -> "PyTreeView[T]":
+        if not isinstance(off, jax.Array):
+            off = int(off)
+        length = np.array(length).item()
+        # the length must be static, and can only be
+        # clamped to the end of the view for a static offset
+        limit = len(self) - off if isinstance(off, int) else len(self)
+        length = min(length or limit, limit)
+        return replace(self, offset=self.offset + off*self.stride, length=length)
+
+    def window(self, window : int, stride : int = 1) -> "PyTreeView[T]":
+        if self.stride != 1 or self.window_length is not None:
+            raise ValueError("Can only window a contiguous view")
+        return replace(self,
+            length=max(0, (self.length - window) // stride + 1),
+            stride=stride, window_length=window
+        )
+
+    def as_pytree(self) -> T:
+        if self.stride == 1 and self.window_length is None:
+            return argon.tree.map(
+                lambda x: jax.lax.dynamic_slice_in_dim(x, self.offset, self.length),
+                self.tree
+            )
+        return self.gather(npx.arange(self.length, dtype=idx_dtype))
+
+# A Walker alias table for O(1) sampling
+# from a discrete distribution.
+@struct(frozen=True)
+class AliasTable:
+    prob: jax.Array
+    alias: jax.Array
+
+    def __len__(self) -> int:
+        return self.prob.shape[0]
+
+    @staticmethod
+    def create(weights : ArrayLike) -> "AliasTable":
+        # Vose's algorithm, run once on the host
+        weights = np.asarray(weights, dtype=np.float64)
+        if weights.ndim != 1 or weights.shape[0] == 0:
+            raise ValueError("Weights must be a non-empty vector")
+        if np.any(weights < 0) or not np.sum(weights) > 0:
+            raise ValueError("Weights must be non-negative with a positive sum")
+        n = weights.shape[0]
+        scaled = weights * n / np.sum(weights)
+        prob = np.ones(n, dtype=np.float64)
+        alias = np.arange(n)
+        small = list(np.nonzero(scaled < 1)[0])
+        large = list(np.nonzero(scaled >= 1)[0])
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1
+            if scaled[l] < 1: small.append(l)
+            else: large.append(l)
+        return AliasTable(
+            prob=npx.array(prob, dtype=npx.float32),
+            alias=npx.array(alias, dtype=idx_dtype)
+        )
+
+    def sample(self, rng_key : jax.Array, shape : Sequence[int]) -> jax.Array:
+        a, b = jax.random.split(rng_key)
+        k = jax.random.randint(a, shape, minval=0, maxval=len(self), dtype=idx_dtype)
+        u = jax.random.uniform(b, shape)
+        return npx.where(u < self.prob[k], k, self.alias[k])
+
+# The position of an IndexedDataStream.
+@struct(frozen=True)
+class IndexedStreamState:
+    offset: jax.Array
+    shuffle_key: jax.Array | None = None
+    indices: jax.Array | None = None
+    permutation_key: jax.Array | None = None
+
 @struct
 class IndexedDataStream(DataStream[T]):
     data: Data[T]
@@ -224,10 +977,23 @@ class IndexedDataStream(DataStream[T]):
     shuffle_key: jax.Array | None
     indices: jax.Array | None
     resample : bool
+    # if set, the shuffled order is computed on the fly
+    # from this key rather than read from indices
+    permutation_key: jax.Array | None = None
+    # if set, elements are sampled from these weights
+    weights: AliasTable | None = None
+    # per-element functions applied to each batch,
+    # compiled together with the gather
+    transforms: tuple[Callable, ...] = ()
 
     @staticmethod
     def create(data, max_offset, batch_shape,
-               shuffle_key=None, resample=False, ):
+               shuffle_key=None, resample=False, lazy=False,
+               weights=None, resume_from=None, transforms=()):
+        if weights is not None:
+            if shuffle_key is None:
+                raise ValueError("Weighted sampling requires a shuffle key")
+            resample = True
         indices_per_batch = math.prod(batch_shape)
         if indices_per_batch > max_offset: 
             # reduce batch_shape to fit at least one batch
@@ -239,43 +1005,94 @@ class IndexedDataStream(DataStream[T]):
 
         batches = max_offset // indices_per_batch
         max_offset = batches * indices_per_batch
-        if shuffle_key is not None and not resample:
+        offset = npx.zeros((), dtype=idx_dtype)
+        indices, permutation_key = None, None
+        if resume_from is not None:
+            # restore the saved permutation rather than regenerating it
+            offset = npx.asarray(resume_from.offset, dtype=idx_dtype)
+            shuffle_key = resume_from.shuffle_key
+            indices = resume_from.indices
+            permutation_key = resume_from.permutation_key
+        elif shuffle_key is not None and not resample:
             shuffle_key, r = jax.random.split(shuffle_key)
-            indices = jax.random.permutation(r, max_offset)
-        else: indices = None
+            if lazy: permutation_key = r
+            else: indices = jax.random.permutation(r, max_offset)
         return IndexedDataStream(
             data=data,
-            offset=npx.zeros((), dtype=idx_dtype),
+            offset=offset,
             max_offset=max_offset,
             batch_shape=batch_shape,
             shuffle_key=shuffle_key,
             indices=indices,
             resample=resample,
+            permutation_key=permutation_key,
+            weights=weights,
+            transforms=tuple(transforms)
         )
 
     def __len__(self):
         batch_size = math.prod(self.batch_shape)
         return (self.max_offset - self.offset) // batch_size
 
+    def state(self) -> IndexedStreamState:
+        return IndexedStreamState(
+            offset=self.offset,
+            shuffle_key=self.shuffle_key,
+            indices=self.indices,
+            permutation_key=self.permutation_key
+        )
+
     @agt.jit
     def has_next(self):
         return self.offset < self.max_offset
 
-    @agt.jit
     def next(self):
+        if profile.active() is None or not self.transforms:
+            return profile.stage("gather", self._next)
+        # while profiling, the maps are run as separate
+        # programs so that each map is attributed its own time
+        data = profile.stage("gather", self._next_unmapped)
+        for fn in self.transforms:
+            data = profile.stage(profile.stage_name("map", fn),
+                                 _map_elements, fn, data, self.batch_shape)
+        return data
+
+    @agt.jit
+    def _next(self):
+        return self.fetch()
+
+    @agt.jit
+    def _next_unmapped(self):
+        return self.fetch(transforms=False)
+
+    # The (traceable) body of next(), which can be called
+    # from within another jitted function to inline the
+    # data pipeline into it (e.g. the training step).
+    def fetch(self, transforms: bool = True):
         shuffle_key = self.shuffle_key
         batch_shape = self.batch_shape
         batch_size = math.prod(batch_shape)
-        if self.resample:
+        if self.weights is not None:
             shuffle_key, r = jax.random.split(shuffle_key)
-            idxs = jax.random.randint(r, (batch_size,), minval=0, maxval=self.max_offset)
-            data = jax.vmap(lambda x: self.data[x])(idxs)
+            data = self.data.gather(self.weights.sample(r, batch_shape))
+        elif self.resample:
+            shuffle_key, r = jax.random.split(shuffle_key)
+            idxs = jax.random.randint(r, batch_shape, minval=0, maxval=self.max_offset)
+            data = self.data.gather(idxs)
         elif self.indices is not None:
-            idxs = jax.lax.dynamic_slice(self.indices, self.offset[None], self.batch_shape)
-            data = jax.vmap(lambda i: self.data[i])(idxs)
+            idxs = jax.lax.dynamic_slice(self.indices, self.offset[None], (batch_size,))
+            data = self.data.gather(npx.reshape(idxs, batch_shape))
+        elif self.permutation_key is not None:
+            idxs = argon.random.permutation_index(self.permutation_key,
+                self.offset + npx.arange(batch_size, dtype=idx_dtype), self.max_offset)
+            idxs = idxs.astype(idx_dtype)
+            data = self.data.gather(npx.reshape(idxs, batch_shape))
         else:
             data = self.data.slice(self.offset, batch_size).as_pytree()
-        data = argon.tree.map(lambda x: npx.reshape(x, batch_shape + x.shape[1:]), data)
+            data = _unflatten_batch(data, batch_shape)
+
+        for fn in (self.transforms if transforms else ()):
+            data = _apply_elements(fn, data, batch_shape)
 
         self.offset = self.offset + batch_size
         self.shuffle_key = shuffle_key
@@ -285,11 +1102,15 @@ class IndexedDataStream(DataStream[T]):
     @agt.jit
     def reset(self):
         self.offset = npx.zeros_like(self.offset)
-        self.indices = None
         if self.shuffle_key is not None and not self.resample:
             shuffle_key, r = argon.random.split(self.shuffle_key)
-            self.indices = argon.random.permutation(r, self.max_offset)
+            if self.permutation_key is not None:
+                self.permutation_key = r
+            else:
+                self.indices = argon.random.permutation(r, self.max_offset)
             self.shuffle_key = shuffle_key
+        else:
+            self.indices = None
 
 @struct(frozen=True)
 class IndexedStreamBuilder(StreamBuilder[T]):
@@ -298,6 +1119,9 @@ class IndexedStreamBuilder(StreamBuilder[T]):
     batch_shape: Sequence[int] | None = None
     shuffle_key: jax.Array | None = None
     resample : bool = False
+    lazy : bool = False
+    weights : AliasTable | None = None
+    transforms : tuple[Callable, ...] = ()
 
     def batch(self, batch_size: int) -> "IndexedStreamBuilder[T]":
         return replace(self, 
@@ -305,15 +1129,28 @@ class IndexedStreamBuilder(StreamBuilder[T]):
             if self.batch_shape else (batch_size,)
         )
     
-    def shuffle(self, rng_key : jax.Array, resample=False) -> "IndexedStreamBuilder[T]":
+    def shuffle(self, rng_key : jax.Array, resample=False, lazy=False) -> "IndexedStreamBuilder[T]":
         return replace(self,
             shuffle_key=rng_key if self.shuffle_key is None else argon.random.fold_in(self.shuffle_key, rng_key),
-            resample=resample or self.resample
+            resample=resample or self.resample,
+            lazy=lazy or self.lazy
         )
 
+    # Maps are fused into the compiled gather of the stream.
+    def map(self, fn: Callable[[T], V]) -> "IndexedStreamBuilder[V]":
+        return replace(self, transforms=self.transforms + (fn,))
+
+    def weighted(self, weights : ArrayLike, rng_key : jax.Array | None = None) -> "IndexedStreamBuilder[T]":
+        table = AliasTable.create(weights)
+        if len(table) != len(self.data):
+            raise ValueError(f"Expected {len(self.data)} weights, got {len(table)}")
+        builder = replace(self, weights=table, resample=True)
+        return builder.shuffle(rng_key) if rng_key is not None else builder
+
     @contextmanager
-    def build(self) -> Generator[DataStream[T], None, None]:
+    def build(self, resume_from: IndexedStreamState | None = None) -> Generator[DataStream[T], None, None]:
         yield IndexedDataStream.create(
             self.data, self.max_offset, self.batch_shape,
-            self.shuffle_key, self.resample
+            self.shuffle_key, self.resample, self.lazy,
+            self.weights, resume_from, self.transforms
         )
\ No newline at end of file
@@ -0,0 +1,186 @@
+from argon.data import Data, idx_dtype
+from argon.struct import struct
+from argon.typing import ArrayLike
+
+import argon.numpy as npx
+import argon.tree
+
+from typing import Any, TypeVar
+
+import jax
+import numpy as np
+
+T = TypeVar('T')
+
+# An encoded leaf, decoded a batch at a time in gather().
+class Encoded:
+    def __len__(self) -> int:
+        raise NotImplementedError()
+
+    def gather(self, idxs : jax.Array) -> jax.Array:
+        raise NotImplementedError()
+
+    @property
+    def structure(self) -> jax.ShapeDtypeStruct:
+        raise NotImplementedError()
+
+    @property
+    def nbytes(self) -> int:
+        return sum(x.nbytes for x in argon.tree.leaves(self)
+                   if isinstance(x, (jax.Array, np.ndarray)))
+
+# A leaf stored as is.
+@struct(frozen=True)
+class Raw(Encoded):
+    values: jax.Array
+
+    def __len__(self) -> int:
+        return self.values.shape[0]
+
+    def gather(self, idxs : jax.Array) -> jax.Array:
+        return self.values[idxs]
+
+    @property
+    def structure(self) -> jax.ShapeDtypeStruct:
+        return jax.ShapeDtypeStruct(self.values.shape[1:], self.values.dtype)
+
+# A leaf stored in a narrower floating point type.
+@struct(frozen=True)
+class Cast(Encoded):
+    values: jax.Array
+    dtype: Any
+
+    def __len__(self) -> int:
+        return self.values.shape[0]
+
+    def gather(self, idxs : jax.Array) -> jax.Array:
+        return self.values[idxs].astype(self.dtype)
+
+    @property
+    def structure(self) -> jax.ShapeDtypeStruct:
+        return jax.ShapeDtypeStruct(self.values.shape[1:], self.dtype)
+
+# A leaf linearly quantized to uint8, with a
+# per-component scale and offset.
+@struct(frozen=True)
+class Quantized(Encoded):
+    values: jax.Array
+    scale: jax.Array
+    offset: jax.Array
+    dtype: Any
+
+    @staticmethod
+    def encode(x : np.ndarray) -> "Quantized":
+        lo, hi = np.min(x, axis=0), np.max(x, axis=0)
+        scale = (hi - lo) / 255
+        values = np.round((x - lo) / np.where(scale == 0, 1, scale))
+        return Quantized(
+            npx.array(np.clip(values, 0, 255).astype(np.uint8)),
+            npx.array(scale, dtype=x.dtype), npx.array(lo, dtype=x.dtype),
+            x.dtype
+        )
+
+    def __len__(self) -> int:
+        return self.values.shape[0]
+
+    def gather(self, idxs : jax.Array) -> jax.Array:
+        values = self.values[idxs].astype(self.scale.dtype)
+        return (values * self.scale + self.offset).astype(self.dtype)
+
+    @property
+    def structure(self) -> jax.ShapeDtypeStruct:
+        return jax.ShapeDtypeStruct(self.values.shape[1:], self.dtype)
+
+# A leaf stored as differences between consecutive elements
+# (in a narrower type), with a full precision keyframe every
+# block elements. Suited to smooth trajectories.
+@struct(frozen=True)
+class DeltaEncoded(Encoded):
+    keyframes: jax.Array
+    deltas: jax.Array
+    length: int
+    block: int
+    dtype: Any
+
+    @staticmethod
+    def encode(x : np.ndarray, block : int, delta_dtype) -> "DeltaEncoded":
+        n = x.shape[0]
+        blocks = -(-n // block)
+        padded = np.concatenate([x, np.repeat(x[-1:], blocks*block - n, axis=0)])
+        padded = padded.reshape((blocks, block) + x.shape[1:])
+        deltas = np.zeros(padded.shape, dtype=delta_dtype)
+        # encode each delta relative to the decoded previous
+        # element, so that rounding errors do not accumulate
+        decoded = padded[:, 0]
+        for i in range(1, block):
+            deltas[:, i] = (padded[:, i] - decoded).astype(delta_dtype)
+            decoded = decoded + deltas[:, i].astype(x.dtype)
+        return DeltaEncoded(
+            npx.array(padded[:, 0]),
+            npx.array(deltas.reshape((blocks*block,) + x.shape[1:])),
+            n, block, x.dtype
+        )
+
+    def __len__(self) -> int:
+        return self.length
+
+    def gather(self, idxs : jax.Array) -> jax.Array:
+        blocks = idxs // self.block
+        steps = npx.arange(self.block, dtype=idx_dtype)
+        deltas = self.deltas[blocks[..., None]*self.block + steps]
+        mask = steps <= (idxs - blocks*self.block)[..., None]
+        mask = npx.reshape(mask, mask.shape + (1,)*(deltas.ndim - mask.ndim))
+        deltas = npx.where(mask, deltas.astype(self.dtype), 0)
+        return self.keyframes[blocks] + npx.sum(deltas, axis=idxs.ndim)
+
+    @property
+    def structure(self) -> jax.ShapeDtypeStruct:
+        return jax.ShapeDtypeStruct(self.keyframes.shape[1:], self.dtype)
+
+_CAST_DTYPES = {"float16": npx.float16, "bfloat16": npx.bfloat16}
+
+def encode(x : ArrayLike, dtype : str | None,
+           delta_block : int | None = None) -> Encoded:
+    x = np.asarray(x)
+    # only floating point leaves are compressed
+    if dtype is None or not np.issubdtype(x.dtype, np.floating) or x.shape[0] == 0:
+        return Raw(npx.asarray(x))
+    if delta_block is not None:
+        if dtype not in _CAST_DTYPES:
+            raise ValueError(f"Delta encoding requires one of {list(_CAST_DTYPES)}, got {dtype}")
+        return DeltaEncoded.encode(x, delta_block, _CAST_DTYPES[dtype])
+    if dtype == "uint8":
+        return Quantized.encode(x)
+    elif dtype in _CAST_DTYPES:
+        return Cast(npx.array(x, dtype=_CAST_DTYPES[dtype]), x.dtype)
+    raise ValueError(f"Unknown compression type {dtype}")
+
+def _is_encoded(x) -> bool:
+    return isinstance(x, Encoded)
+
+# A Data with compressed leaves, which are
+# decoded as part of the (jitted) batch gather.
+@struct(frozen=True)
+class CompressedData(Data[T]):
+    leaves: T
+
+    @property
+    def nbytes(self) -> int:
+        return sum(l.nbytes for l in argon.tree.leaves(self.leaves, is_leaf=_is_encoded))
+
+    def __len__(self) -> int:
+        leaves = argon.tree.leaves(self.leaves, is_leaf=_is_encoded)
+        return len(leaves[0]) if leaves else 0
+
+    def __getitem__(self, idx : ArrayLike) -> T:
+        idx = npx.asarray(idx, dtype=idx_dtype)
+        assert idx.ndim == 0
+        return self.gather(idx)
+
+    def gather(self, idxs : ArrayLike) -> T:
+        idxs = npx.asarray(idxs, dtype=idx_dtype)
+        return argon.tree.map(lambda l: l.gather(idxs), self.leaves, is_leaf=_is_encoded)
+
+    @property
+    def structure(self) -> T:
+        return argon.tree.map(lambda l: l.structure, self.leaves, is_leaf=_is_encoded)
@@ -0,0 +1,620 @@
+from argon.data import Data, PyTreeData, idx_dtype, _map_chunked
+from argon.struct import struct, replace
+from argon.typing import ArrayLike
+
+import argon.numpy as npx
+import argon.transforms as agt
+import argon.tree
+import argon.data.profile as profile
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Generic, TypeVar
+
+import jax
+import time
+import types
+import hashlib
+import functools
+import dataclasses
+import threading
+import numpy as np
+
+T = TypeVar('T')
+
+# Stands in for a leaf which is not read (see Data.project),
+# it is filled with zeros on the device instead.
+class _Unread:
+    def __init__(self, shape, dtype):
+        self.shape = shape
+        self.dtype = dtype
+
+def _project(tree, used):
+    return jax.tree.map(
+        lambda x, u: x if u else _Unread(x.shape, x.dtype),
+        tree, used
+    )
+
+# A pytree of host-side arrays (numpy arrays, memmaps, zarr arrays).
+# The container is opaque to jax transformations: it is treated as a
+# static value (hashed by identity), so the arrays themselves are never
+# copied to the device in full. Only gathered batches are transferred.
+class HostArrays(Generic[T]):
+    def __init__(self, tree: T):
+        lengths = set(x.shape[0] for x in argon.tree.leaves(tree))
+        if len(lengths) > 1:
+            raise ValueError(f"All arrays must have the same leading axis, got {lengths}")
+        self.tree = tree
+        self.length = lengths.pop() if lengths else 0
+
+    @property
+    def structure(self) -> T:
+        return argon.tree.map(
+            lambda x: jax.ShapeDtypeStruct(x.shape[1:],
+                jax.dtypes.canonicalize_dtype(x.dtype)),
+            self.tree
+        )
+
+    def project(self, used: T) -> "HostArrays[T]":
+        return HostArrays(_project(self.tree, used))
+
+    # Reads the given leaves (by their flattened index).
+    def read(self, idxs: np.ndarray, leaves: list[int]) -> list[np.ndarray]:
+        arrays = jax.tree.leaves(self.tree)
+        structure = jax.tree.leaves(self.structure)
+        return [_read(arrays[i], idxs, structure[i].dtype) for i in leaves]
+
+def _read(array, idxs: np.ndarray, dtype) -> np.ndarray:
+    flat = idxs.reshape(-1)
+    if flat.size == 0:
+        values = np.zeros((0,) + array.shape[1:], dtype=dtype)
+    elif np.all(np.diff(flat) == 1):
+        # contiguous range, read as a single slice
+        values = array[flat[0]:flat[-1] + 1]
+    else:
+        # read each row once and in order, which is
+        # much friendlier to the page cache / chunk layout
+        unique, inverse = np.unique(flat, return_inverse=True)
+        values = np.asarray(array[unique])[inverse]
+    return np.asarray(values, dtype=dtype).reshape(idxs.shape + array.shape[1:])
+
+# A Data backed by a pytree of host-side arrays.
+# Slicing is zero-copy (only the offset and length change)
+# and gather() reads exactly the requested rows in a single
+# host callback.
+@struct(frozen=True)
+class HostData(Data[T]):
+    arrays: HostArrays[T]
+    offset: int
+    length: int
+
+    @classmethod
+    def from_arrays(cls, tree: T) -> "HostData[T]":
+        arrays = HostArrays(tree)
+        return cls(arrays, 0, arrays.length)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, idx : ArrayLike) -> T:
+        idx = npx.asarray(idx, dtype=idx_dtype)
+        assert idx.ndim == 0
+        return self.gather(idx)
+
+    def gather(self, idxs : ArrayLike) -> T:
+        idxs = npx.asarray(idxs, dtype=idx_dtype)
+        return self.gather_masked(idxs, npx.ones(idxs.shape, dtype=bool))
+
+    # Only the rows where mask is true are read, the others are zero.
+    def gather_masked(self, idxs : ArrayLike, mask : jax.Array) -> T:
+        idxs = npx.asarray(idxs, dtype=idx_dtype)
+        # out-of-bounds indices are clamped, as for jax arrays
+        idxs = npx.clip(idxs, 0, self.length - 1) + self.offset
+        arrays = self.arrays
+        structure, treedef = jax.tree.flatten(arrays.structure)
+        outputs = [jax.ShapeDtypeStruct(idxs.shape + s.shape, s.dtype) for s in structure]
+        leaves = [i for i, x in enumerate(jax.tree.leaves(arrays.tree))
+                  if not isinstance(x, _Unread)]
+        def read(idxs, mask):
+            t = time.perf_counter()
+            idxs = np.asarray(idxs)
+            mask = np.broadcast_to(np.asarray(mask), idxs.shape)
+            if mask.all():
+                out = arrays.read(idxs, leaves)
+            else:
+                out = []
+                for v in arrays.read(idxs[mask], leaves):
+                    o = np.zeros(idxs.shape + v.shape[1:], v.dtype)
+                    o[mask] = v
+                    out.append(o)
+            # excluded from the enclosing (e.g. gather) stage
+            profile.record("host_read", time.perf_counter() - t, out)
+            return out
+        values = jax.pure_callback(read, [outputs[i] for i in leaves],
+                                   idxs, mask, vmap_method="expand_dims") if leaves else []
+        out = [npx.zeros(o.shape, o.dtype) for o in outputs]
+        for i, v in zip(leaves, values):
+            out[i] = v
+        return jax.tree.unflatten(treedef, out)
+
+    @property
+    def structure(self) -> T:
+        return self.arrays.structure
+
+    def project(self, used : T) -> "HostData[T]":
+        return replace(self, arrays=self.arrays.project(used))
+
+    def slice(self, off : ArrayLike, length : ArrayLike) -> "HostData[T]":
+        if not isinstance(off, jax.Array):
+            off = int(off)
+        length = np.array(length).item()
+        # the length can only be clamped to
+        # the end of the view for a static offset
+        limit = self.length - off if isinstance(off, int) else self.length
+        length = min(length or limit, limit)
+        return replace(self, offset=self.offset + off, length=length)
+
+    def to_host(self, chunk_size : int | None = None) -> "HostData[T]":
+        return self
+
+def _identity(x):
+    return x
+
+def to_host(data : Data[T], chunk_size : int | None = None) -> HostData[T]:
+    n = len(data)
+    out = argon.tree.map(
+        lambda s: np.empty((n,) + tuple(s.shape), dtype=np.dtype(s.dtype)),
+        data.structure
+    )
+    off = 0
+    for chunk in _map_chunked(data, _identity, chunk_size or max(n, 1)):
+        chunk = jax.device_get(chunk)
+        size = argon.tree.leaves(chunk)[0].shape[0] if argon.tree.leaves(chunk) else 0
+        for o, c in zip(argon.tree.leaves(out), argon.tree.leaves(chunk)):
+            o[off:off + size] = c
+        off += size
+    return HostData.from_arrays(out)
+
+# The globals referenced by the code of fn (including nested functions).
+# Functions of other modules (e.g. libraries) only contribute their name.
+def _referenced_globals(fn: types.FunctionType) -> dict[str, Any]:
+    names, codes = set(), [fn.__code__]
+    while codes:
+        code = codes.pop()
+        names.update(code.co_names)
+        codes.extend(c for c in code.co_consts if isinstance(c, types.CodeType))
+    values = {}
+    for name in sorted(names):
+        if name not in fn.__globals__:
+            continue
+        v = fn.__globals__[name]
+        if (callable(v) and not isinstance(v, type)
+                and getattr(v, "__module__", None) != fn.__module__):
+            v = f"{getattr(v, '__module__', None)}.{getattr(v, '__qualname__', type(v).__name__)}"
+        values[name] = v
+    return values
+
+# Arrays up to this size are hashed by their contents
+_HASHED_BYTES = 1 << 20
+# The number of elements of persisted data which are hashed
+_HASHED_ELEMENTS = 16
+
+# Feeds a canonical description of a pipeline into h:
+# the code (closures and referenced globals) of functions and the
+# static values of structs. Larger arrays only contribute
+# their shape and dtype.
+def _fingerprint(x, h, seen: set):
+    if x is None or isinstance(x, (str, bytes, int, float, bool, complex, np.generic, np.dtype)):
+        h.update(f"{type(x).__name__}:{x!r};".encode())
+        return
+    if isinstance(x, type):
+        h.update(f"type:{x.__module__}.{x.__qualname__};".encode())
+        return
+    if isinstance(x, types.ModuleType):
+        h.update(f"module:{x.__name__};".encode())
+        return
+    if hasattr(x, "shape") and hasattr(x, "dtype"):
+        h.update(f"array:{tuple(x.shape)}:{x.dtype};".encode())
+        # small (in memory) arrays are hashed in full
+        if (isinstance(x, (np.ndarray, jax.Array)) and not isinstance(x, jax.core.Tracer)
+                and x.size * np.dtype(x.dtype).itemsize <= _HASHED_BYTES):
+            h.update(np.ascontiguousarray(jax.device_get(x)).tobytes())
+        return
+    if id(x) in seen:
+        h.update(b"cycle;")
+        return
+    seen.add(id(x))
+    if isinstance(x, (tuple, list)):
+        h.update(f"{type(x).__name__}:{len(x)};".encode())
+        for v in x:
+            _fingerprint(v, h, seen)
+    elif isinstance(x, dict):
+        h.update(f"dict:{len(x)};".encode())
+        for k, v in sorted(x.items(), key=lambda kv: repr(kv[0])):
+            _fingerprint(k, h, seen)
+            _fingerprint(v, h, seen)
+    elif isinstance(x, functools.partial):
+        h.update(b"partial;")
+        _fingerprint((x.func, x.args, x.keywords), h, seen)
+    elif hasattr(x, "__wrapped__"):
+        # e.g. jit-compiled functions
+        _fingerprint(x.__wrapped__, h, seen)
+    elif isinstance(x, types.MethodType):
+        _fingerprint((x.__func__, x.__self__), h, seen)
+    elif isinstance(x, types.FunctionType):
+        closure = tuple(c.cell_contents for c in x.__closure__ or ())
+        _fingerprint((x.__code__, x.__defaults__, closure,
+                      _referenced_globals(x)), h, seen)
+    elif isinstance(x, types.CodeType):
+        h.update(x.co_code)
+        _fingerprint((x.co_names, x.co_consts), h, seen)
+    elif dataclasses.is_dataclass(x):
+        _fingerprint(type(x), h, seen)
+        _fingerprint({f.name: getattr(x, f.name) for f in dataclasses.fields(x)}, h, seen)
+    else:
+        # other objects (e.g. caches) only contribute their type
+        _fingerprint(type(x), h, seen)
+
+def _open_persisted(path: Path) -> "ZarrData":
+    import argon.store
+    import zarr
+    meta = argon.store.load(str(path), path="meta")
+    leaves, treedef = jax.tree.flatten(meta.tree)
+    group = zarr.open_group(str(path), path="elements", mode="r")
+    return ZarrData.from_arrays(jax.tree.unflatten(treedef,
+        [group[str(i)] for i in range(len(leaves))]
+    ))
+
+def persist(data : Data[T], path : str | Path, key : Any = None,
+            chunk_size : int = 4096) -> "ZarrData[T]":
+    import argon.store
+    import zarr
+    path = Path(path)
+    n = len(data)
+    structure, treedef = jax.tree.flatten(data.structure)
+    h = hashlib.sha256()
+    _fingerprint((data, n, structure, str(treedef), key), h, set())
+    # a sample of the elements, to tell apart data from
+    # sources which are not hashed (e.g. large arrays, files)
+    if n > 0:
+        idxs = np.linspace(0, n - 1, min(n, _HASHED_ELEMENTS)).astype(np.int64)
+        for x in jax.device_get(jax.tree.leaves(data.gather(npx.asarray(idxs, dtype=idx_dtype)))):
+            h.update(np.ascontiguousarray(x).tobytes())
+    fingerprint = h.hexdigest()
+    if path.exists():
+        try: existing = zarr.open_group(str(path), mode="r").attrs.get("fingerprint")
+        except FileNotFoundError: existing = None
+        if existing == fingerprint:
+            return _open_persisted(path)
+    root = zarr.open_group(str(path), mode="w")
+    group = root.create_group("elements")
+    arrays = [
+        group.create_array(str(i), shape=(n,) + tuple(s.shape),
+            chunks=(max(min(chunk_size, n), 1),) + tuple(s.shape),
+            dtype=np.dtype(s.dtype))
+        for i, s in enumerate(structure)
+    ]
+    off = 0
+    for chunk in _map_chunked(data, _identity, chunk_size):
+        leaves = jax.device_get(jax.tree.leaves(chunk))
+        size = leaves[0].shape[0] if leaves else 0
+        for a, x in zip(arrays, leaves):
+            a[off:off + size] = x
+        off += size
+    # the elements are only stored as an empty
+    # tree, to recover the element pytree structure
+    empty = jax.tree.unflatten(treedef, [
+        np.zeros((0,) + tuple(s.shape), s.dtype) for s in structure
+    ])
+    argon.store.dump(PyTreeData(empty), str(path), path="meta")
+    # written last, marks the data as complete
+    zarr.open_group(str(path), mode="r+").attrs["fingerprint"] = fingerprint
+    return _open_persisted(path)
+
+# A Data backed by memory-mapped .npy files, one per leaf.
+@struct(frozen=True)
+class MmapData(HostData[T]):
+    @staticmethod
+    def save(path: str | Path, tree: T):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for i, leaf in enumerate(argon.tree.leaves(tree)):
+            np.save(path / f"{i}.npy", np.asarray(leaf))
+
+    # The structure is any pytree with the same
+    # tree definition as the saved one (e.g. data.structure)
+    @classmethod
+    def load(cls, path: str | Path, structure: T) -> "MmapData[T]":
+        path = Path(path)
+        leaves, treedef = jax.tree.flatten(structure)
+        arrays = [
+            np.load(path / f"{i}.npy", mmap_mode="r")
+            for i in range(len(leaves))
+        ]
+        return cls.from_arrays(jax.tree.unflatten(treedef, arrays))
+
+# A Data backed by zarr arrays, read lazily chunk-by-chunk.
+@struct(frozen=True)
+class ZarrData(HostData[T]):
+    # Opens data written by argon.store.dump().
+    # Any PyTreeData in the stored object is replaced
+    # by a lazily-read ZarrData, e.g. a stored SequenceData
+    # is opened with ZarrData elements and sequences.
+    @classmethod
+    def load(cls, store, *, path=None) -> Any:
+        import argon.store
+        node = argon.store.load(store, lazy=True, path=path)
+        return jax.tree.map(
+            lambda x: cls.from_arrays(x.tree) if isinstance(x, PyTreeData) else x,
+            node, is_leaf=lambda x: isinstance(x, PyTreeData)
+        )
+
+@agt.jit
+def _gather(data : Data[T], idxs : jax.Array) -> T:
+    return data.gather(idxs)
+
+# A host-side LRU cache of (realized) elements of a Data, keyed by index.
+# Like HostArrays, it is treated as a static value under jax transformations.
+class ElementCache(Generic[T]):
+    def __init__(self, data: Data[T], max_bytes: int):
+        self.data = data
+        self.max_bytes = max_bytes
+        self.structure = argon.tree.map(
+            lambda s: jax.ShapeDtypeStruct(s.shape, s.dtype),
+            data.structure
+        )
+        self.element_bytes = sum(
+            np.dtype(s.dtype).itemsize * int(np.prod(s.shape))
+            for s in argon.tree.leaves(self.structure)
+        )
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def bytes(self) -> int:
+        return len(self._entries) * self.element_bytes
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits, "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries), "bytes": self.bytes
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _insert(self, idx, leaves):
+        if self.element_bytes > self.max_bytes:
+            return
+        self._entries[idx] = leaves
+        while self.bytes > self.max_bytes:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def gather(self, idxs: np.ndarray) -> T:
+        idxs = np.asarray(idxs)
+        flat = idxs.reshape(-1)
+        unique = list(dict.fromkeys(flat.tolist()))
+        with self._lock:
+            found = {}
+            for i in unique:
+                leaves = self._entries.get(i)
+                if leaves is not None:
+                    self._entries.move_to_end(i)
+                    found[i] = leaves
+            missing = [i for i in unique if i not in found]
+            self.hits += flat.size - len(missing)
+            self.misses += len(missing)
+        if missing:
+            # pad the missing indices to the number of requested
+            # elements so that the same kernel is reused across batches
+            padded = np.full((flat.size,), missing[0], dtype=flat.dtype)
+            padded[:len(missing)] = missing
+            values = _gather(self.data, npx.asarray(padded, dtype=idx_dtype))
+            values = [np.asarray(v) for v in argon.tree.leaves(values)]
+            with self._lock:
+                for j, i in enumerate(missing):
+                    leaves = tuple(v[j] for v in values)
+                    found[i] = leaves
+                    self._insert(i, leaves)
+        leaves, treedef = jax.tree.flatten(self.structure)
+        out = [
+            np.asarray(np.stack([found[i][k] for i in flat.tolist()]),
+                dtype=s.dtype).reshape(idxs.shape + s.shape)
+            if flat.size > 0 else np.zeros(idxs.shape + s.shape, s.dtype)
+            for k, s in enumerate(leaves)
+        ]
+        return jax.tree.unflatten(treedef, out)
+
+# Memoizes the elements of an (expensive to compute) Data
+# in a host-side LRU cache with a bounded memory footprint.
+@struct(frozen=True)
+class MemoizedData(Data[T]):
+    memo: ElementCache[T]
+
+    @property
+    def data(self) -> Data[T]:
+        return self.memo.data
+
+    def stats(self) -> dict[str, int]:
+        return self.memo.stats()
+
+    def __len__(self) -> int:
+        return len(self.memo.data)
+
+    def __getitem__(self, idx : ArrayLike) -> T:
+        idx = npx.asarray(idx, dtype=idx_dtype)
+        assert idx.ndim == 0
+        return self.gather(idx)
+
+    def gather(self, idxs : ArrayLike) -> T:
+        idxs = npx.asarray(idxs, dtype=idx_dtype)
+        cache = self.memo
+        return jax.pure_callback(cache.gather,
+            argon.tree.map(
+                lambda s: jax.ShapeDtypeStruct(idxs.shape + s.shape, s.dtype),
+                cache.structure
+            ),
+            idxs, vmap_method="expand_dims"
+        )
+
+    @property
+    def structure(self) -> T:
+        return self.memo.structure
+
+# Host-side storage of trajectories as padded zarr arrays of shape
+# (trajectories, max_length, ...), chunked so that every trajectory is
+# exactly one chunk. Elements are addressed by their (flat) index and read
+# through an LRU cache of decompressed chunks.
+# Like HostArrays, it is treated as a static value under jax transformations.
+class TrajectoryArrays(Generic[T]):
+    def __init__(self, tree: T, lengths: np.ndarray, max_bytes: int):
+        self.tree = tree
+        self.lengths = np.asarray(lengths)
+        self.starts = np.concatenate([[0], np.cumsum(self.lengths)[:-1]]).astype(np.int64)
+        self.length = int(np.sum(self.lengths))
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def structure(self) -> T:
+        return argon.tree.map(
+            lambda x: jax.ShapeDtypeStruct(x.shape[2:],
+                jax.dtypes.canonicalize_dtype(x.dtype)),
+            self.tree
+        )
+
+    @property
+    def bytes(self) -> int:
+        return self._bytes
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits, "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries), "bytes": self.bytes
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def project(self, used: T) -> "TrajectoryArrays[T]":
+        return TrajectoryArrays(_project(self.tree, used), self.lengths, self.max_bytes)
+
+    # The (decompressed) chunk of leaf i for trajectory t
+    def _chunk(self, t: int, i: int) -> np.ndarray:
+        key = (t, i)
+        with self._lock:
+            chunk = self._entries.get(key)
+            if chunk is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return chunk
+            self.misses += 1
+        chunk = np.asarray(jax.tree.leaves(self.tree)[i][t, :self.lengths[t]])
+        with self._lock:
+            if chunk.nbytes <= self.max_bytes and key not in self._entries:
+                self._entries[key] = chunk
+                self._bytes += chunk.nbytes
+                while self._bytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._bytes -= evicted.nbytes
+                    self.evictions += 1
+        return chunk
+
+    # Reads the given leaves (by their flattened index).
+    def read(self, idxs: np.ndarray, leaves: list[int]) -> list[np.ndarray]:
+        flat = idxs.reshape(-1)
+        trajectories = np.searchsorted(self.starts, flat, side="right") - 1
+        steps = flat - self.starts[trajectories]
+        structure = jax.tree.leaves(self.structure)
+        out = []
+        for i in leaves:
+            s = structure[i]
+            o = np.empty((flat.size,) + s.shape, s.dtype)
+            for t in np.unique(trajectories):
+                mask = trajectories == t
+                o[mask] = self._chunk(int(t), i)[steps[mask]]
+            out.append(o.reshape(idxs.shape + s.shape))
+        return out
+
+# A Data backed by TrajectoryArrays. Sampling windows of
+# a trajectory (e.g. with SequenceData.chunk) only reads
+# the trajectories which are touched.
+@struct(frozen=True)
+class TrajectoryData(HostData[T]):
+    arrays: TrajectoryArrays[T]
+
+    def stats(self) -> dict[str, int]:
+        return self.arrays.stats()
+
+    # Writes a SequenceData with one (padded) zarr chunk per trajectory.
+    # The sequence infos are stored alongside (with argon.store).
+    @staticmethod
+    def save(path: str | Path, data: "SequenceData[T, Any]"):
+        import argon.store
+        import zarr
+        from argon.data.sequence import SequenceData
+        sequences = jax.device_get(data.sequences.as_pytree())
+        starts = np.asarray(sequences.start_idx)
+        lengths = np.asarray(sequences.length)
+        max_length = max(int(np.max(lengths, initial=0)), 1)
+        structure, treedef = jax.tree.flatten(data.elements.structure)
+
+        root = zarr.open_group(str(path), mode="w")
+        group = root.create_group("trajectories")
+        arrays = [
+            group.create_array(str(i),
+                shape=(len(lengths), max_length) + tuple(s.shape),
+                chunks=(1, max_length) + tuple(s.shape),
+                dtype=np.dtype(s.dtype), fill_value=0
+            ) for i, s in enumerate(structure)
+        ]
+        for t, (start, length) in enumerate(zip(starts, lengths)):
+            if length == 0:
+                continue
+            elements = data.elements.slice(int(start), int(length)).as_pytree()
+            for a, x in zip(arrays, jax.tree.leaves(jax.device_get(elements))):
+                a[t, :length] = x
+        # the trajectories are stored back-to-back
+        offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(starts.dtype)
+        sequences = replace(sequences,
+            start_idx=npx.asarray(offsets),
+            end_idx=npx.asarray(offsets + lengths),
+            length=npx.asarray(lengths)
+        )
+        # the elements are only stored as an empty
+        # tree, to recover the element pytree structure
+        empty = jax.tree.unflatten(treedef, [
+            np.zeros((0,) + tuple(s.shape), s.dtype) for s in structure
+        ])
+        meta = SequenceData(PyTreeData(empty), PyTreeData(sequences))
+        argon.store.dump(meta, str(path), path="meta")
+
+    @classmethod
+    def load(cls, path: str | Path, *,
+             cache_bytes: int = 256*1024*1024) -> "SequenceData[T, Any]":
+        import argon.store
+        import zarr
+        from argon.data.sequence import SequenceData
+        meta = argon.store.load(str(path), path="meta")
+        _, treedef = jax.tree.flatten(meta.elements.tree)
+        group = zarr.open_group(str(path), path="trajectories", mode="r")
+        tree = jax.tree.unflatten(treedef,
+            [group[str(i)] for i in range(treedef.num_leaves)]
+        )
+        lengths = np.asarray(meta.sequences.tree.length)
+        arrays = TrajectoryArrays(tree, lengths, cache_bytes)
+        return SequenceData(cls(arrays, 0, arrays.length), meta.sequences)
@@ -14,4 +14,22 @@ def read_image(path, expected_shape, /, *args, **kwargs):
     return jax.pure_callback(read,
         jax.ShapeDtypeStruct(expected_shape, jnp.uint8),
         args, kwargs
-    )
\ No newline at end of file
+    )
+
+# Reads a batch of images in a single host callback.
+# The path is formatted with each of the indices.
+def read_images(path, expected_shape, indices, /):
+    path = str(path)
+    indices = jnp.asarray(indices)
+    def read(indices):
+        indices = np.asarray(indices)
+        data = np.zeros(indices.shape + tuple(expected_shape), dtype=np.uint8)
+        for i in np.ndindex(indices.shape):
+            image = np.asarray(Image.open(path.format(indices[i])), dtype=np.uint8)
+            assert image.shape == tuple(expected_shape)
+            data[i] = image
+        return data
+    return jax.pure_callback(read,
+        jax.ShapeDtypeStruct(indices.shape + tuple(expected_shape), jnp.uint8),
+        indices
+    )
@@ -6,6 +6,7 @@ import jax.tree
 
 from argon.struct import struct, replace
 from argon.data import PyTreeData, Data
+from argon.data.reduce import MeanVar, Covariance
 
 import abc
 import jax
@@ -118,16 +119,9 @@ class LinearNormalizer(Generic[T], Normalizer[T]):
             data, self.min, self.max)
 
     @staticmethod
-    def from_data(data : T) -> "LinearNormalizer[T]":
-        # For simplicity must be a PyTreeData
-        # Convert to PyTreeFormat
-        min = jax.tree.map(
-            lambda x: jnp.min(x, axis=0), data.tree
-        )
-        max = jax.tree.map(
-            lambda x: jnp.max(x, axis=0), data.tree
-        )
-        return LinearNormalizer(min, max)
+    def from_data(data : Data[T], chunk_size : int = 4096) -> "LinearNormalizer[T]":
+        stats = data.statistics(chunk_size)
+        return LinearNormalizer(stats.min, stats.max)
 
 @struct(frozen=True)
 class Identity(Generic[T], Normalizer[T]):
@@ -211,27 +205,24 @@ class StdNormalizer(Generic[T], Normalizer[T]):
         return StdNormalizer(new_mean, new_var, new_std, total)
 
     @staticmethod
-    def from_data(data : Data[T], component_wise=True):
-        data = data.as_pytree()
-        data_flat = jax.vmap(lambda x: jax.flatten_util.ravel_pytree(x)[0])(data)
-        unflatten = jax.flatten_util.ravel_pytree(jax.tree.map(lambda x: x[0], data))[1]
+    def from_data(data : Data[T], component_wise=True, chunk_size : int = 4096):
+        unflatten = jax.flatten_util.ravel_pytree(
+            jax.tree.map(lambda s: jnp.zeros(s.shape, s.dtype), data.structure)
+        )[1]
+        data_flat = data.map(lambda x: jax.flatten_util.ravel_pytree(x)[0])
+        moments = data_flat.reduce(MeanVar(), chunk_size)
+        mean = moments.mean
         if component_wise:
-            mean = jnp.mean(data_flat, axis=0)
-            var = jnp.var(data_flat, axis=0)
-            std = jnp.sqrt(var)
-            return StdNormalizer(
-                mean=unflatten(mean), var=unflatten(var),
-                std=unflatten(std), count=data_flat.shape[0]
-            )
+            var = moments.var
         else:
-            mean = jnp.mean(data_flat, axis=0)
-            var = jnp.var(jnp.linalg.norm(data_flat - mean[None,:], axis=-1), axis=0)
-            var = var*jnp.ones_like(data_flat[0])
-            std = jnp.sqrt(var)
-            return StdNormalizer(
-                mean=unflatten(mean), var=unflatten(var), 
-                std=unflatten(std), count=data_flat.shape[0]
-            )
+            norms = data_flat.map(lambda x: jnp.linalg.norm(x - mean))
+            var = norms.reduce(MeanVar(), chunk_size).var
+            var = var*jnp.ones_like(mean)
+        std = jnp.sqrt(var)
+        return StdNormalizer(
+            mean=unflatten(mean), var=unflatten(var),
+            std=unflatten(std), count=int(moments.count)
+        )
 
     @staticmethod
     def empty_for(sample):
@@ -262,12 +253,13 @@ class PCANormalizer:
         return unnormalized
 
     @staticmethod
-    def from_data(data : Data[T], dims=None):
-        data = data.as_pytree()
-        mean = jax.tree.map(lambda x: jnp.mean(x, axis=0), data)
-        data_flat = jax.vmap(lambda x: jax.flatten_util.ravel_pytree(x)[0])(data)
-        C = jnp.cov(data_flat, rowvar=False)
-        U, S, _ = jnp.linalg.svd(C)
+    def from_data(data : Data[T], dims=None, chunk_size : int = 4096):
+        unflatten = jax.flatten_util.ravel_pytree(
+            jax.tree.map(lambda s: jnp.zeros(s.shape, s.dtype), data.structure)
+        )[1]
+        state = data.reduce(Covariance(), chunk_size)
+        mean = unflatten(state.mean)
+        U, S, _ = jnp.linalg.svd(state.cov)
         if dims is not None:
             U = U[:,:dims]
             S = S[:dims]
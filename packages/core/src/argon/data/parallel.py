@@ -0,0 +1,241 @@
+from argon.data import DataStream, StreamBuilder
+from argon.struct import struct, replace
+
+import argon.numpy as npx
+import argon.data.profile as profile
+
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from typing import Any, Callable, Generator, Generic, TypeVar
+
+import jax
+import math
+import queue
+import traceback
+import multiprocessing
+import numpy as np
+
+T = TypeVar('T')
+V = TypeVar('V')
+
+# The layout of a flattened pytree inside a shared memory buffer:
+# a treedef and (offset, shape, dtype) for every leaf.
+# Only this (small) description is sent between processes,
+# the array data itself never gets pickled.
+@struct(frozen=True)
+class _Layout:
+    treedef: Any
+    leaves: tuple[tuple[int, tuple[int, ...], str], ...]
+    nbytes: int
+
+    @staticmethod
+    def create(treedef, shapes, dtypes) -> "_Layout":
+        leaves, off = [], 0
+        for shape, dtype in zip(shapes, dtypes):
+            dtype = np.dtype(dtype)
+            # keep every leaf aligned
+            off = -(-off // 64) * 64
+            leaves.append((off, tuple(shape), dtype.str))
+            off += dtype.itemsize * math.prod(shape)
+        return _Layout(treedef, tuple(leaves), max(off, 1))
+
+    def views(self, buffer) -> list[np.ndarray]:
+        return [
+            np.ndarray(shape, dtype=np.dtype(dtype), buffer=buffer, offset=off)
+            for off, shape, dtype in self.leaves
+        ]
+
+def _worker_main(fn, batched, tasks, results):
+    shms = {}
+    def attach(name):
+        if name not in shms:
+            shms[name] = shared_memory.SharedMemory(name=name)
+        return shms[name]
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            in_name, in_layout, out_name, out_layout, start, stop = task
+            try:
+                inputs = in_layout.views(attach(in_name).buf)
+                outputs = out_layout.views(attach(out_name).buf)
+                if batched:
+                    shard = jax.tree.unflatten(in_layout.treedef,
+                                               [x[start:stop] for x in inputs])
+                    out = jax.tree.leaves(fn(shard))
+                    for o, v in zip(outputs, out):
+                        o[start:stop] = v
+                else:
+                    for i in range(start, stop):
+                        element = jax.tree.unflatten(in_layout.treedef,
+                                                     [x[i] for x in inputs])
+                        out = jax.tree.leaves(fn(element))
+                        for o, v in zip(outputs, out):
+                            o[i] = v
+                results.put((start, None))
+            except BaseException:
+                results.put((start, traceback.format_exc()))
+    finally:
+        for shm in shms.values():
+            shm.close()
+
+class _SharedBuffer:
+    def __init__(self):
+        self.shm = None
+
+    def ensure(self, nbytes: int) -> shared_memory.SharedMemory:
+        if self.shm is None or self.shm.size < nbytes:
+            self.release()
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        return self.shm
+
+    def release(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+# A pool of worker processes which apply a host-side
+# python function to shards of a batch. Inputs and outputs
+# are exchanged through shared memory buffers.
+class WorkerPool(Generic[T, V]):
+    def __init__(self, fn: Callable[[T], V], workers: int,
+                 batched: bool = False, structure: V | None = None):
+        if workers < 1:
+            raise ValueError(f"Number of workers must be positive, got {workers}")
+        self.fn = fn
+        self.workers = workers
+        self.batched = batched
+        self.structure = structure
+        # spawn (rather than fork) so that workers
+        # do not inherit the state of the jax runtime
+        ctx = multiprocessing.get_context("spawn")
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+        self._processes = [
+            ctx.Process(target=_worker_main,
+                args=(fn, batched, self._tasks, self._results),
+                name=f"argon-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for p in self._processes:
+            p.start()
+        self._inputs = _SharedBuffer()
+        self._outputs = _SharedBuffer()
+
+    def _output_structure(self, leaves, treedef):
+        if self.structure is None:
+            # infer the output structure by running on the first element
+            if self.batched:
+                out = self.fn(jax.tree.unflatten(treedef, [x[:1] for x in leaves]))
+                out = jax.tree.map(lambda x: np.asarray(x)[0], out)
+            else:
+                out = self.fn(jax.tree.unflatten(treedef, [x[0] for x in leaves]))
+            self.structure = jax.tree.map(
+                lambda x: jax.ShapeDtypeStruct(np.shape(x), np.asarray(x).dtype), out
+            )
+        return self.structure
+
+    def __call__(self, batch: T) -> V:
+        leaves, treedef = jax.tree.flatten(batch)
+        leaves = [np.asarray(x) for x in jax.device_get(leaves)]
+        n = leaves[0].shape[0] if leaves else 0
+        structure = self._output_structure(leaves, treedef)
+        out_leaves, out_treedef = jax.tree.flatten(structure)
+
+        in_layout = _Layout.create(treedef,
+            [x.shape for x in leaves], [x.dtype for x in leaves])
+        out_layout = _Layout.create(out_treedef,
+            [(n,) + tuple(s.shape) for s in out_leaves], [s.dtype for s in out_leaves])
+        in_shm = self._inputs.ensure(in_layout.nbytes)
+        out_shm = self._outputs.ensure(out_layout.nbytes)
+        for view, x in zip(in_layout.views(in_shm.buf), leaves):
+            view[...] = x
+
+        # contiguous shards, each worker writes its own rows
+        # so the output order is deterministic
+        bounds = np.linspace(0, n, min(self.workers, max(n, 1)) + 1).astype(int)
+        shards = [(s, e) for s, e in zip(bounds[:-1], bounds[1:]) if e > s]
+        for s, e in shards:
+            self._tasks.put((in_shm.name, in_layout, out_shm.name, out_layout, int(s), int(e)))
+        errors = []
+        for _ in shards:
+            _, error = self._get_result()
+            if error is not None:
+                errors.append(error)
+        if errors:
+            raise RuntimeError(f"Worker failed:\n{errors[0]}")
+        # copy out of the shared buffer, which is reused for the next batch
+        outputs = [npx.array(v) for v in out_layout.views(out_shm.buf)]
+        return jax.tree.unflatten(out_treedef, outputs)
+
+    # Wait for a result, failing (rather than blocking forever)
+    # if a worker was killed, e.g. by a segfault or the OOM killer.
+    def _get_result(self):
+        while True:
+            try:
+                return self._results.get(timeout=1.0)
+            except queue.Empty:
+                dead = [p for p in self._processes if not p.is_alive()]
+                if dead:
+                    raise RuntimeError(
+                        f"Worker {dead[0].name} died with exit code {dead[0].exitcode}"
+                    )
+
+    def close(self):
+        for _ in self._processes:
+            self._tasks.put(None)
+        for p in self._processes:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+        self._inputs.release()
+        self._outputs.release()
+
+class ParallelMapStream(DataStream[V]):
+    def __init__(self, stream: DataStream[T], pool: WorkerPool[T, V]):
+        self.stream = stream
+        self.pool = pool
+
+    def __len__(self):
+        return len(self.stream)
+
+    def has_next(self):
+        return self.stream.has_next()
+
+    def next(self) -> V:
+        return profile.stage(profile.stage_name("parallel_map", self.pool.fn),
+                             self.pool, self.stream.next())
+
+    def reset(self):
+        return self.stream.reset()
+
+    def state(self) -> Any:
+        return self.stream.state()
+
+@struct(frozen=True)
+class ParallelMapStreamBuilder(StreamBuilder[V]):
+    builder: StreamBuilder[T]
+    fn: Callable[[T], V]
+    workers: int
+    batched: bool = False
+    structure: V | None = None
+
+    def batch(self, batch_size: int) -> "ParallelMapStreamBuilder[V]":
+        return replace(self, builder=self.builder.batch(batch_size))
+
+    def shuffle(self, rng_key : jax.Array, resample=False, lazy=False) -> "ParallelMapStreamBuilder[V]":
+        return replace(self, builder=self.builder.shuffle(rng_key, resample, lazy))
+
+    def weighted(self, weights, rng_key : jax.Array | None = None) -> "ParallelMapStreamBuilder[V]":
+        return replace(self, builder=self.builder.weighted(weights, rng_key))
+
+    @contextmanager
+    def build(self, resume_from: Any = None) -> Generator[DataStream[V], None, None]:
+        with self.builder.build(resume_from) as stream:
+            pool = WorkerPool(self.fn, self.workers, self.batched, self.structure)
+            try:
+                yield ParallelMapStream(stream, pool)
+            finally:
+                pool.close()
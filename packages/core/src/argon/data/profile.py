@@ -0,0 +1,144 @@
+import argon.tree
+
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Generator, TypeVar
+
+import jax
+import time
+import threading
+import numpy as np
+
+T = TypeVar('T')
+
+# Upper edges (in seconds) of the latency histogram buckets
+_BUCKETS = ((1e-4, "le_100us"), (1e-3, "le_1ms"), (1e-2, "le_10ms"),
+            (1e-1, "le_100ms"), (1., "le_1s"), (np.inf, "gt_1s"))
+
+def _batch_size(batch) -> tuple[int, int]:
+    leaves = [x for x in argon.tree.leaves(batch) if hasattr(x, "shape")]
+    elements = leaves[0].shape[0] if leaves and leaves[0].ndim > 0 else 1
+    return elements, sum(int(np.prod(x.shape)) * np.dtype(x.dtype).itemsize for x in leaves)
+
+class StageStats:
+    def __init__(self, window: int):
+        self.latencies = deque(maxlen=window)
+        self.calls = 0
+        self.time = 0.
+        self.elements = 0
+        self.bytes = 0
+
+    def record(self, seconds: float, elements: int, nbytes: int):
+        self.latencies.append(seconds)
+        self.calls += 1
+        self.time += seconds
+        self.elements += elements
+        self.bytes += nbytes
+
+    def metrics(self) -> dict[str, Any]:
+        latencies = np.array(self.latencies)
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) if len(latencies) else (0., 0., 0.)
+        edges = np.array([e for e, _ in _BUCKETS])
+        counts = np.bincount(np.searchsorted(edges, latencies), minlength=len(edges))
+        time = max(self.time, 1e-9)
+        return {
+            "latency": {
+                "mean": float(np.mean(latencies)) if len(latencies) else 0.,
+                "p50": float(p50), "p90": float(p90), "p99": float(p99)
+            },
+            "histogram": {name: int(c) for (_, name), c in zip(_BUCKETS, counts)},
+            "elements_per_s": self.elements / time,
+            "bytes_per_s": self.bytes / time,
+            "calls": self.calls
+        }
+
+# Collects the time spent in each stage of a data pipeline.
+# Stage times are exclusive: the time a stage spends waiting
+# on its input stage is attributed to the input stage.
+# Outputs are synchronized (block_until_ready) before timing,
+# so asynchronous dispatch does not hide the cost of a stage.
+class Profiler:
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self.stages = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self) -> list[list[float]]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    # Records time measured outside of run(), e.g. inside a host callback.
+    # Like a nested stage, it is excluded from the stage running on
+    # this thread. Callbacks which XLA runs on another thread are
+    # not, and are then also counted in the enclosing stage.
+    def record(self, name: str, seconds: float, output: Any = None):
+        stack = self._stack()
+        if stack:
+            stack[-1][0] += seconds
+        self._record(name, seconds, output)
+
+    def _record(self, name: str, seconds: float, output: Any = None):
+        elements, nbytes = _batch_size(output) if output is not None else (0, 0)
+        with self._lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats(self.window)
+            stats.record(seconds, elements, nbytes)
+
+    def run(self, name: str, fn: Callable[..., T], *args) -> T:
+        stack = self._stack()
+        # accumulates the time spent in nested stages
+        stack.append([0.])
+        t = time.perf_counter()
+        try:
+            output = jax.block_until_ready(fn(*args))
+        finally:
+            total = time.perf_counter() - t
+            child_time = stack.pop()[0]
+            if stack:
+                stack[-1][0] += total
+        self._record(name, total - child_time, output)
+        return output
+
+    def metrics(self) -> dict[str, Any]:
+        with self._lock:
+            return {name: stats.metrics() for name, stats in self.stages.items()}
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+
+_active: Profiler | None = None
+
+def active() -> Profiler | None:
+    return _active
+
+# Enables instrumentation of all data pipeline
+# stages (on all threads) within the context.
+@contextmanager
+def profiling(profiler: Profiler | None = None) -> Generator[Profiler, None, None]:
+    global _active
+    profiler = profiler or Profiler()
+    previous, _active = _active, profiler
+    try:
+        yield profiler
+    finally:
+        _active = previous
+
+# Runs fn(*args) as the named stage
+# if profiling is enabled.
+def stage(name: str, fn: Callable[..., T], *args) -> T:
+    profiler = _active
+    if profiler is None:
+        return fn(*args)
+    return profiler.run(name, fn, *args)
+
+def record(name: str, seconds: float, output: Any = None):
+    profiler = _active
+    if profiler is not None:
+        profiler.record(name, seconds, output)
+
+def stage_name(kind: str, fn: Callable) -> str:
+    return f"{kind}:{getattr(fn, '__name__', type(fn).__name__)}"
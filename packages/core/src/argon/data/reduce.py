@@ -0,0 +1,191 @@
+from argon.struct import struct
+
+import argon.numpy as npx
+import argon.tree
+
+from typing import Generic, TypeVar
+
+import jax
+import jax.flatten_util
+
+T = TypeVar('T')
+S = TypeVar('S')
+R = TypeVar('R')
+
+# A streaming reduction over batches of elements.
+# update() receives a batch (with a leading batch axis)
+# and a mask of the valid elements in the batch.
+class Reducer(Generic[T, S, R]):
+    def init(self, structure: T) -> S:
+        raise NotImplementedError()
+
+    def update(self, state: S, batch: T, mask: jax.Array) -> S:
+        raise NotImplementedError()
+
+    def finalize(self, state: S) -> R:
+        return state
+
+def _expand(mask, x):
+    return npx.reshape(mask, mask.shape + (1,)*(x.ndim - mask.ndim))
+
+def _float(x):
+    return x.astype(npx.promote_types(x.dtype, npx.float32))
+
+def _float_dtype(dtype):
+    return npx.promote_types(dtype, npx.float32)
+
+@struct(frozen=True)
+class Sum(Reducer[T, T, T]):
+    def init(self, structure: T) -> T:
+        return argon.tree.map(lambda s: npx.zeros(s.shape, s.dtype), structure)
+
+    def update(self, state: T, batch: T, mask: jax.Array) -> T:
+        return argon.tree.map(
+            lambda s, x: s + npx.sum(npx.where(_expand(mask, x), x, 0), axis=0).astype(s.dtype),
+            state, batch
+        )
+
+def _max_value(dtype):
+    if npx.issubdtype(dtype, npx.floating): return npx.inf
+    elif npx.issubdtype(dtype, npx.bool_): return True
+    return npx.iinfo(dtype).max
+
+def _min_value(dtype):
+    if npx.issubdtype(dtype, npx.floating): return -npx.inf
+    elif npx.issubdtype(dtype, npx.bool_): return False
+    return npx.iinfo(dtype).min
+
+@struct(frozen=True)
+class Min(Reducer[T, T, T]):
+    def init(self, structure: T) -> T:
+        return argon.tree.map(lambda s: npx.full(s.shape, _max_value(s.dtype), s.dtype), structure)
+
+    def update(self, state: T, batch: T, mask: jax.Array) -> T:
+        return argon.tree.map(
+            lambda s, x: npx.minimum(s, npx.min(
+                npx.where(_expand(mask, x), x, _max_value(x.dtype)), axis=0
+            )), state, batch
+        )
+
+@struct(frozen=True)
+class Max(Reducer[T, T, T]):
+    def init(self, structure: T) -> T:
+        return argon.tree.map(lambda s: npx.full(s.shape, _min_value(s.dtype), s.dtype), structure)
+
+    def update(self, state: T, batch: T, mask: jax.Array) -> T:
+        return argon.tree.map(
+            lambda s, x: npx.maximum(s, npx.max(
+                npx.where(_expand(mask, x), x, _min_value(x.dtype)), axis=0
+            )), state, batch
+        )
+
+@struct(frozen=True)
+class Moments(Generic[T]):
+    count: jax.Array
+    mean: T
+    # sum of squared deviations from the mean
+    m2: T
+
+    @property
+    def var(self) -> T:
+        return argon.tree.map(lambda m2: m2 / npx.maximum(self.count, 1), self.m2)
+
+    @property
+    def std(self) -> T:
+        return argon.tree.map(npx.sqrt, self.var)
+
+# Per-component mean and variance, merging
+# batches with the parallel (Chan et al.) Welford update.
+@struct(frozen=True)
+class MeanVar(Reducer[T, Moments[T], Moments[T]]):
+    def init(self, structure: T) -> Moments[T]:
+        zeros = argon.tree.map(lambda s: npx.zeros(s.shape, _float_dtype(s.dtype)), structure)
+        return Moments(npx.zeros((), npx.float32), zeros, zeros)
+
+    def update(self, state: Moments[T], batch: T, mask: jax.Array) -> Moments[T]:
+        n_b = npx.sum(mask).astype(state.count.dtype)
+        total = state.count + n_b
+        def update_leaf(mean, m2, x):
+            x = _float(x)
+            m = _expand(mask, x)
+            mean_b = npx.sum(npx.where(m, x, 0), axis=0) / npx.maximum(n_b, 1)
+            m2_b = npx.sum(npx.where(m, npx.square(x - mean_b), 0), axis=0)
+            delta = mean_b - mean
+            new_mean = mean + delta * n_b / npx.maximum(total, 1)
+            new_m2 = m2 + m2_b + npx.square(delta) * state.count * n_b / npx.maximum(total, 1)
+            return new_mean, new_m2
+        means, treedef = jax.tree.flatten(state.mean)
+        updated = [update_leaf(mean, m2, x) for mean, m2, x in zip(
+            means, jax.tree.leaves(state.m2), jax.tree.leaves(batch)
+        )]
+        mean = jax.tree.unflatten(treedef, [m for m, _ in updated])
+        m2 = jax.tree.unflatten(treedef, [m2 for _, m2 in updated])
+        return Moments(total, mean, m2)
+
+@struct(frozen=True)
+class CovarianceState:
+    count: jax.Array
+    mean: jax.Array
+    # sum of outer products of deviations from the mean
+    comoment: jax.Array
+
+    @property
+    def cov(self) -> jax.Array:
+        # unbiased, matching npx.cov
+        return self.comoment / npx.maximum(self.count - 1, 1)
+
+# Mean and covariance of the flattened elements.
+@struct(frozen=True)
+class Covariance(Reducer[T, CovarianceState, CovarianceState]):
+    def init(self, structure: T) -> CovarianceState:
+        sample = argon.tree.map(lambda s: npx.zeros(s.shape, s.dtype), structure)
+        flat, _ = jax.flatten_util.ravel_pytree(sample)
+        flat = _float(flat)
+        return CovarianceState(
+            npx.zeros((), npx.float32),
+            npx.zeros_like(flat),
+            npx.zeros(flat.shape*2, flat.dtype)
+        )
+
+    def update(self, state: CovarianceState, batch: T, mask: jax.Array) -> CovarianceState:
+        x = _float(jax.vmap(lambda x: jax.flatten_util.ravel_pytree(x)[0])(batch))
+        n_b = npx.sum(mask).astype(state.count.dtype)
+        total = state.count + n_b
+        m = mask[:, None]
+        mean_b = npx.sum(npx.where(m, x, 0), axis=0) / npx.maximum(n_b, 1)
+        centered = npx.where(m, x - mean_b, 0)
+        comoment_b = centered.T @ centered
+        delta = mean_b - state.mean
+        mean = state.mean + delta * n_b / npx.maximum(total, 1)
+        comoment = state.comoment + comoment_b + npx.outer(delta, delta) * state.count * n_b / npx.maximum(total, 1)
+        return CovarianceState(total, mean, comoment)
+
+@struct(frozen=True)
+class Statistics(Generic[T]):
+    count: jax.Array
+    mean: T
+    var: T
+    min: T
+    max: T
+
+    @property
+    def std(self) -> T:
+        return argon.tree.map(npx.sqrt, self.var)
+
+# Count, mean, variance, min and max in a single pass.
+@struct(frozen=True)
+class StatisticsReducer(Reducer[T, tuple, Statistics[T]]):
+    def init(self, structure: T) -> tuple:
+        return (MeanVar().init(structure), Min().init(structure), Max().init(structure))
+
+    def update(self, state: tuple, batch: T, mask: jax.Array) -> tuple:
+        moments, min, max = state
+        return (
+            MeanVar().update(moments, batch, mask),
+            Min().update(min, batch, mask),
+            Max().update(max, batch, mask)
+        )
+
+    def finalize(self, state: tuple) -> Statistics[T]:
+        moments, min, max = state
+        return Statistics(moments.count, moments.mean, moments.var, min, max)
@@ -0,0 +1,233 @@
+from argon.data import Data, PyTreeData, idx_dtype
+from argon.data.sequence import SequenceData, SequenceInfo
+from argon.struct import struct, replace
+from argon.typing import ArrayLike
+
+import argon.numpy as npx
+import argon.transforms as agt
+import argon.tree
+
+from typing import Generic, TypeVar
+
+import jax
+
+T = TypeVar('T')
+I = TypeVar('I')
+
+def _is_traced(x) -> bool:
+    return isinstance(x, jax.core.Tracer)
+
+# A Data in preallocated (device) storage, to which elements can be added.
+# The capacity is doubled when needed, which requires the size to be
+# known (i.e. outside of jit). Under jit, elements which do not fit
+# are dropped, use reserve() beforehand.
+# Indices are in the order in which elements were added (0 is the oldest).
+@struct(frozen=True)
+class AppendableData(Data[T]):
+    buffer: T
+    # the number of elements ever added
+    count: jax.Array
+    # the number of (most recent) elements held
+    size: jax.Array
+
+    # not a field, so that it stays static under jit
+    ring = False
+
+    # If ring, returns a RingData instead.
+    @staticmethod
+    def create(structure: T, capacity: int, ring: bool = False) -> "AppendableData[T]":
+        buffer = argon.tree.map(
+            lambda s: npx.zeros((capacity,) + tuple(s.shape), s.dtype), structure
+        )
+        zero = npx.zeros((), dtype=idx_dtype)
+        return (RingData if ring else AppendableData)(buffer, zero, zero)
+
+    @property
+    def capacity(self) -> int:
+        return argon.tree.axis_size(self.buffer)
+
+    def __len__(self) -> int:
+        return int(self.size)
+
+    def __getitem__(self, idx : ArrayLike) -> T:
+        idx = npx.asarray(idx, dtype=idx_dtype)
+        assert idx.ndim == 0
+        return self.gather(idx)
+
+    def gather(self, idxs : ArrayLike) -> T:
+        idxs = npx.asarray(idxs, dtype=idx_dtype)
+        physical = (self.count - self.size + idxs) % self.capacity
+        return argon.tree.map(lambda x: x[physical], self.buffer)
+
+    @property
+    def structure(self) -> T:
+        return argon.tree.map(
+            lambda x: jax.ShapeDtypeStruct(x.shape[1:], x.dtype), self.buffer
+        )
+
+    # Grow the storage (by doubling) to hold at least capacity elements.
+    def reserve(self, capacity: int) -> "AppendableData[T]":
+        current = self.capacity
+        if capacity <= current:
+            return self
+        if self.ring:
+            raise ValueError("Cannot grow a ring buffer")
+        new_capacity = max(current, 1)
+        while new_capacity < capacity:
+            new_capacity *= 2
+        buffer = argon.tree.map(
+            lambda x: npx.concatenate([x,
+                npx.zeros((new_capacity - current,) + x.shape[1:], x.dtype)
+            ]), self.buffer
+        )
+        return replace(self, buffer=buffer)
+
+    # Add a batch of elements (along the leading axis),
+    # or only those where mask is true. Outside of jit, the storage
+    # is donated and updated in place, so self must not be used afterwards.
+    def add_batch(self, batch: T, mask: jax.Array | None = None) -> "AppendableData[T]":
+        data = self
+        if _is_traced(self.size):
+            return data._add(batch, mask)
+        if not self.ring:
+            data = data.reserve(int(self.size) + argon.tree.axis_size(batch))
+        return _add_batch(data.buffer, replace(data, buffer=None), batch, mask)
+
+    def _add(self, batch: T, mask: jax.Array | None) -> "AppendableData[T]":
+        n = argon.tree.axis_size(batch)
+        capacity = self.capacity
+        mask = npx.ones((n,), dtype=bool) if mask is None else mask
+        # compact the masked elements
+        pos = npx.cumsum(mask, dtype=idx_dtype) - 1
+        added = npx.sum(mask, dtype=idx_dtype)
+        if self.ring:
+            # only the last capacity elements are kept, as if added
+            # one at a time, so that no two writes go to the same slot
+            mask = mask & (pos >= added - capacity)
+        idxs = self.count + pos
+        if self.ring:
+            idxs = idxs % capacity
+        # out of bounds writes are dropped
+        idxs = npx.where(mask, idxs, capacity)
+        buffer = argon.tree.map(
+            lambda b, x: b.at[idxs].set(x, mode="drop"), self.buffer, batch
+        )
+        if self.ring:
+            count = self.count + added
+            size = npx.minimum(self.size + added, capacity)
+        else:
+            count = size = npx.minimum(self.count + added, capacity)
+        return replace(self, buffer=buffer, count=count, size=size)
+
+    # Sample elements uniformly (with replacement).
+    def sample(self, rng_key: jax.Array, shape=()) -> T:
+        idxs = jax.random.randint(rng_key, shape, 0,
+            npx.maximum(self.size, 1), dtype=idx_dtype)
+        return self.gather(idxs)
+
+# An AppendableData with fixed capacity, in which the oldest
+# elements are overwritten once the storage is full.
+@struct(frozen=True)
+class RingData(AppendableData[T]):
+    ring = True
+
+# Only the storage is donated, count and size may be the same array.
+@agt.jit(donate_argnums=(0,))
+def _add_batch(buffer: T, data: AppendableData[T], batch: T,
+               mask: jax.Array | None) -> AppendableData[T]:
+    return replace(data, buffer=buffer)._add(batch, mask)
+
+# Trajectories (e.g. from argon.policy.rollout) stored in AppendableData,
+# so that adding trajectories does not copy the existing ones.
+# If ring, the oldest trajectories are evicted once either the
+# elements or the sequence infos are full.
+@struct(frozen=True)
+class ReplayBuffer(Generic[T, I]):
+    elements: AppendableData[T]
+    # start_idx and end_idx count all elements ever added
+    sequences: AppendableData[SequenceInfo[I]]
+
+    @staticmethod
+    def create(structure: T, capacity: int, sequence_capacity: int,
+               info_structure: I = None, ring: bool = False) -> "ReplayBuffer[T, I]":
+        idx = jax.ShapeDtypeStruct((), jax.dtypes.canonicalize_dtype(idx_dtype))
+        infos = SequenceInfo(info=info_structure, start_idx=idx, end_idx=idx, length=idx)
+        return ReplayBuffer(
+            AppendableData.create(structure, capacity, ring),
+            AppendableData.create(infos, sequence_capacity, ring)
+        )
+
+    def __len__(self) -> int:
+        return len(self.sequences)
+
+    # Grow the storage to hold at least capacity elements
+    # and sequence_capacity trajectories, see AppendableData.reserve().
+    def reserve(self, capacity: int, sequence_capacity: int) -> "ReplayBuffer[T, I]":
+        return ReplayBuffer(
+            self.elements.reserve(capacity),
+            self.sequences.reserve(sequence_capacity)
+        )
+
+    # Add N trajectories padded to length L, with leading (N, L) axes.
+    # lengths (of shape (N,)) defaults to L for all trajectories.
+    def add_trajectories(self, elements: T, lengths: jax.Array | None = None,
+                         infos: I = None) -> "ReplayBuffer[T, I]":
+        N, L = argon.tree.axis_size(elements, 0), argon.tree.axis_size(elements, 1)
+        lengths = (npx.full((N,), L, dtype=idx_dtype) if lengths is None
+                   else npx.asarray(lengths, dtype=idx_dtype))
+        buffer = self
+        if not self.elements.ring and not _is_traced(self.elements.size):
+            buffer = self.reserve(len(self.elements) + int(npx.sum(lengths)),
+                                  len(self.sequences) + N)
+        starts = buffer.elements.count + npx.cumsum(lengths) - lengths
+        fits = npx.ones((N,), dtype=bool)
+        if not buffer.elements.ring:
+            # under jit, the trajectories which do not fit are dropped
+            # (with all of their elements), use reserve() beforehand
+            fits = ((starts + lengths <= buffer.elements.capacity)
+                & (buffer.sequences.count + npx.arange(N, dtype=idx_dtype)
+                   < buffer.sequences.capacity))
+        mask = (npx.arange(L, dtype=idx_dtype)[None, :] < lengths[:, None]) & fits[:, None]
+        flat = argon.tree.map(lambda x: npx.reshape(x, (N*L,) + x.shape[2:]), elements)
+        new_elements = buffer.elements.add_batch(flat, npx.reshape(mask, (-1,)))
+        sequences = buffer.sequences.add_batch(SequenceInfo(
+            info=infos, start_idx=starts,
+            end_idx=starts + lengths, length=lengths
+        ), fits)
+        if sequences.ring:
+            # evict the trajectories whose elements were overwritten,
+            # these are always the oldest ones
+            oldest = new_elements.count - new_elements.size
+            idxs = npx.arange(sequences.capacity, dtype=idx_dtype)
+            starts = sequences.gather(idxs).start_idx
+            evicted = npx.sum((idxs < sequences.size) & (starts < oldest), dtype=idx_dtype)
+            sequences = replace(sequences, size=sequences.size - evicted)
+        return ReplayBuffer(new_elements, sequences)
+
+    def add_trajectory(self, elements: T, info: I = None) -> "ReplayBuffer[T, I]":
+        return self.add_trajectories(
+            argon.tree.map(lambda x: x[None], elements), None,
+            argon.tree.map(lambda x: x[None], info)
+        )
+
+    # Sample elements of the held trajectories uniformly (with replacement).
+    def sample(self, rng_key: jax.Array, shape=()) -> T:
+        elements = self.elements
+        oldest = elements.count - elements.size
+        # the held trajectories are contiguous, up to the last element
+        first = npx.where(self.sequences.size > 0,
+            self.sequences[0].start_idx, elements.count) - oldest
+        idxs = jax.random.randint(rng_key, shape, first,
+            npx.maximum(elements.size, first + 1), dtype=idx_dtype)
+        return elements.gather(idxs)
+
+    # A view of the held trajectories. Only the (small)
+    # sequence infos are copied, the elements are not.
+    def as_sequence_data(self) -> SequenceData[T, I]:
+        oldest = self.elements.count - self.elements.size
+        infos = self.sequences.as_pytree()
+        infos = replace(infos,
+            start_idx=infos.start_idx - oldest,
+            end_idx=infos.end_idx - oldest
+        )
+        return SequenceData(self.elements, PyTreeData(infos))
@@ -1,13 +1,16 @@
-from argon.data import Data, PyTreeData, idx_dtype
+from argon.data import Data, PyTreeData, DataStream, StreamBuilder, idx_dtype
 from argon.struct import struct, replace
 
 import argon.numpy as npx
 import argon.tree as tree
 import argon.transforms as agt
+import argon.data.profile as profile
 
+import jax
 import numpy as np
 
-from typing import Any, Generic, TypeVar
+from contextlib import contextmanager
+from typing import Any, Generic, TypeVar, Generator, Sequence
 
 T = TypeVar('T')
 I = TypeVar('I')
@@ -41,12 +44,22 @@ class SequenceData(Generic[T,I]):
             sequences=self.sequences
         )
 
+    # See Data.select()
+    def select(self, fields):
+        return SequenceData(
+            elements=self.elements.select(fields),
+            sequences=self.sequences
+        )
+
     def slice(self, idx, len):
-        start_off = self.sequences[idx].start_idx
-        end_off = self.sequences[idx + len].start_idx
+        start_off = int(self.sequences[idx].start_idx)
+        end_off = int(self.sequences[idx + len - 1].end_idx)
         elem = self.elements.slice(start_off, end_off - start_off)
         seq = self.sequences.slice(idx, len).map(
-            lambda x: replace(x, start_idx=x.start_idx - start_off)
+            lambda x: replace(x,
+                start_idx=x.start_idx - start_off,
+                end_idx=x.end_idx - start_off
+            )
         )
         return SequenceData(
             elem, seq
@@ -64,24 +77,25 @@ class SequenceData(Generic[T,I]):
             sequences=self.sequences.append(data.sequences.map(add_idx))
         )
     
-    def cache(self):
+    def cache(self, chunk_size=None, device=None):
         return SequenceData(
-            elements=self.elements.cache(),
+            elements=self.elements.cache(chunk_size, device),
             sequences=self.sequences.cache()
         )
 
+    # Compress the (cached) elements, see PyTreeData.compress()
+    def compress(self, dtype="uint8", delta_block=None):
+        return SequenceData(
+            elements=self.elements.cache().compress(dtype, delta_block),
+            sequences=self.sequences
+        )
+
     # Conversions to Data[T] objects:
 
     # Will truncate the sequences to a particular length
     def truncate(self, length: int) -> Data[T]:
-        infos = self.sequences.as_pytree()
-        mask = length <= infos.length
-        infos = tree.map(lambda x: x[mask], infos)
-        start_idx = infos.start_idx
-        elements = agt.vmap(
-            lambda x: self.elements.slice(x, length).as_pytree()
-        )(start_idx)
-        return PyTreeData(elements)
+        infos = self.sequences.filter(lambda x: length <= x.length).as_pytree()
+        return WindowData(self.elements, infos.start_idx, length)
     
     # convert to pytree if all sequences are the same length
     def as_pytree(self) -> tuple[I, T]:
@@ -100,37 +114,70 @@ class SequenceData(Generic[T,I]):
     # or replicate the last/first element.
     def uniform_padded(self, length: int) -> Data[T]:
         infos = self.sequences.as_pytree()
-        mask = infos.length < length
-        def gen_indices(s_index, traj_len):
-            return s_index + npx.minimum(npx.arange(length), traj_len - 1)
-        indices = agt.vmap(gen_indices)(infos.start_idx, infos.length)
-        elements = agt.vmap(agt.vmap(lambda x: self.elements[x]))(indices)
-        return PyTreeData(elements)
+        return WindowData(self.elements, infos.start_idx, length, infos.length)
+
+    # Batches of sequences grouped by length, each padded only to
+    # the length of its bucket. buckets is either the bucket lengths,
+    # or a number of buckets chosen from the quantiles of the lengths.
+    # Sequences longer than the largest bucket are truncated.
+    def bucketed(self, buckets: int | Sequence[int] = 4) -> "BucketedStreamBuilder[T,I]":
+        lengths = np.asarray(self.sequences.map(lambda x: x.length).as_pytree())
+        if isinstance(buckets, int):
+            if len(lengths) == 0:
+                raise ValueError("Cannot choose buckets for empty data")
+            quantiles = np.quantile(lengths, np.linspace(0, 1, buckets + 1)[1:])
+            buckets = np.unique(np.ceil(quantiles).astype(int))
+        buckets = tuple(sorted(int(b) for b in buckets))
+        return BucketedStreamBuilder(self, buckets)
+
+    # Concatenates the sequences (in order) into rows of
+    # exactly length elements, with per-element segment ids
+    # (1-based within each row, 0 for padding at the end)
+    # and positions within the sequence. Sequences which
+    # do not fit are continued on the next row.
+    def pack(self, length: int) -> "PackedData[T]":
+        infos = self.sequences.map(lambda x: (x.start_idx, x.length)).as_pytree()
+        starts, lengths = (np.asarray(x) for x in infos)
+        cum_lengths = np.concatenate([np.zeros((1,), dtype=np.int64), np.cumsum(lengths)])
+        return PackedData(
+            elements=self.elements,
+            starts=npx.array(starts, dtype=idx_dtype),
+            cum_lengths=npx.array(cum_lengths, dtype=idx_dtype),
+            length=length
+        )
 
     # Constructs a sliding window over the data!
     # Can optionally add padding to the start/end
-    def chunk(self, chunk_length: int, chunk_stride: int = 1) -> "ChunkData[T,I]":
-        total_chunks = 0
-        infos = self.sequences.as_pytree()
-        chunks = (infos.length - chunk_length + chunk_stride) // chunk_stride
-        chunks = npx.maximum(0, chunks)
-        start_chunks = npx.cumsum(chunks) - chunks
-        total_chunks = npx.sum(chunks)
-
-        t_off, i_off = np.zeros((2, total_chunks), dtype=idx_dtype)
-        for i in range(len(self.sequences)):
-            idx = start_chunks[i]
-            n_chunks = chunks[i]
-            t_off[idx:idx+n_chunks] = infos.start_idx[i] + np.arange(n_chunks) * chunk_stride
-            i_off[idx:idx+n_chunks] = i
-            idx += n_chunks
+    # If lazy, no per-chunk offsets are stored and chunks are
+    # located by a binary search over the cumulative chunk counts.
+    def chunk(self, chunk_length: int, chunk_stride: int = 1,
+              lazy: bool = False) -> "ChunkData[T,I]":
+        infos = self.sequences.map(lambda x: (x.start_idx, x.length)).as_pytree()
+        starts, lengths = (np.asarray(x) for x in infos)
+        chunks = (lengths - chunk_length + chunk_stride) // chunk_stride
+        chunks = np.maximum(0, chunks)
+        cum_chunks = np.concatenate([np.zeros((1,), dtype=chunks.dtype), np.cumsum(chunks)])
+        if lazy:
+            return ChunkData(
+                elements=self.elements,
+                sequences=self.sequences,
+                chunk_offsets=None,
+                chunk_length=chunk_length,
+                chunk_stride=chunk_stride,
+                cum_chunks=npx.array(cum_chunks, dtype=idx_dtype)
+            )
+        total_chunks = int(cum_chunks[-1])
+        i_off = np.repeat(np.arange(len(chunks)), chunks)
+        local = np.arange(total_chunks) - cum_chunks[:-1][i_off]
+        t_off = starts[i_off] + local * chunk_stride
         t_off, i_off = npx.array(t_off, dtype=idx_dtype), npx.array(i_off, dtype=idx_dtype)
 
         return ChunkData(
             elements=self.elements,
             sequences=self.sequences,
             chunk_offsets=PyTreeData((t_off, i_off)),
-            chunk_length=chunk_length
+            chunk_length=chunk_length,
+            chunk_stride=chunk_stride
         )
     
     @staticmethod
@@ -166,6 +213,53 @@ class SequenceData(Generic[T,I]):
             sequences=sequences
         )
 
+# Windows of window elements at the given starts.
+# If lengths are given, windows are padded past the
+# length by replicating the last element. Only the
+# starts are stored, elements are gathered on access.
+@struct(frozen=True)
+class WindowData(Data[T]):
+    elements: Data[T]
+    starts: jax.Array
+    window: int
+    lengths: jax.Array | None = None
+
+    def __len__(self) -> int:
+        return self.starts.shape[0]
+
+    def __getitem__(self, idx) -> T:
+        idx = npx.asarray(idx, dtype=idx_dtype)
+        assert idx.ndim == 0
+        return self.gather(idx)
+
+    def gather(self, idxs) -> T:
+        idxs = npx.asarray(idxs, dtype=idx_dtype)
+        steps = npx.arange(self.window, dtype=idx_dtype)
+        if self.lengths is not None:
+            steps = npx.minimum(steps, self.lengths[idxs][..., None] - 1)
+        return self.elements.gather(self.starts[idxs][..., None] + steps)
+
+    @property
+    def structure(self) -> T:
+        return tree.map(
+            lambda s: jax.ShapeDtypeStruct((self.window,) + s.shape, s.dtype),
+            self.elements.structure
+        )
+
+    def slice(self, off, length) -> "WindowData[T]":
+        if not isinstance(off, jax.Array):
+            off = int(off)
+        length = np.array(length).item()
+        # the length must be static, and can only be
+        # clamped to the end of the data for a static offset
+        limit = len(self) - off if isinstance(off, int) else len(self)
+        length = min(length or limit, limit)
+        take = lambda x: jax.lax.dynamic_slice_in_dim(x, off, length)
+        return replace(self,
+            starts=take(self.starts),
+            lengths=take(self.lengths) if self.lengths is not None else None
+        )
+
 @struct(frozen=True)
 class Chunk(Generic[T,I]):
     seq_offset: int
@@ -178,18 +272,217 @@ class ChunkData(Data, Generic[T,I]):
     sequences: Data[SequenceInfo[I]]
     # contains the timepoints, infos offsets
     # offset by points_offset, infos_offset
-    chunk_offsets: Data[tuple[int, int]]
+    # (None for lazily computed offsets)
+    chunk_offsets: Data[tuple[int, int]] | None
     chunk_length: int 
+    chunk_stride: int = 1
+    # the number of chunks before each sequence,
+    # used to compute the offsets lazily
+    cum_chunks: jax.Array | None = None
 
     def __len__(self) -> int:
+        if self.chunk_offsets is None:
+            return int(self.cum_chunks[-1])
         return len(self.chunk_offsets)
+
+    def _offsets(self, i):
+        if self.chunk_offsets is not None:
+            return self.chunk_offsets[i]
+        i = npx.asarray(i, dtype=idx_dtype)
+        i_off = npx.searchsorted(self.cum_chunks, i, side="right") - 1
+        i_off = npx.clip(i_off, 0, self.cum_chunks.shape[0] - 2)
+        start_idx = self.sequences[i_off].start_idx
+        t_off = start_idx + (i - self.cum_chunks[i_off]) * self.chunk_stride
+        return t_off, i_off
     
     def __getitem__(self, i) -> Chunk[T, I]:
-        t_off, i_off = self.chunk_offsets[i]
+        t_off, i_off = self._offsets(i)
         info = self.sequences[i_off]
         chunk = self.elements.slice(t_off, self.chunk_length).as_pytree()
         return Chunk(
             seq_offset=t_off - info.start_idx,
             elements=chunk,
             info=info.info
-        )
\ No newline at end of file
+        )
+    # Per-chunk weights for stream().weighted(...), such that
+    # sequences are sampled proportionally to sequence_weights
+    # (e.g. the sequence lengths, or a quality score).
+    def chunk_weights(self, sequence_weights) -> jax.Array:
+        sequence_weights = np.asarray(sequence_weights, dtype=np.float64)
+        if self.chunk_offsets is None:
+            counts = np.diff(np.asarray(self.cum_chunks))
+            i_off = np.repeat(np.arange(counts.shape[0]), counts)
+        else:
+            i_off = np.asarray(self.chunk_offsets.as_pytree()[1])
+            counts = np.bincount(i_off, minlength=sequence_weights.shape[0])
+        return npx.array(sequence_weights[i_off] / counts[i_off], dtype=npx.float32)
+
+# A batch of sequences padded to a common length.
+# Padding repeats the last element and is marked
+# invalid in the mask. Rows which only pad out
+# the batch have zero length.
+@struct(frozen=True)
+class PaddedSequence(Generic[T,I]):
+    elements: T
+    mask: jax.Array
+    length: jax.Array
+    info: I
+
+@agt.jit(static_argnums=(2,))
+def _gather_padded(data: SequenceData[T,I], idxs: jax.Array, length: int) -> PaddedSequence[T,I]:
+    valid = idxs >= 0
+    infos = data.sequences.gather(npx.maximum(idxs, 0))
+    seq_length = npx.where(valid, npx.minimum(infos.length, length), 0)
+    steps = npx.arange(length, dtype=idx_dtype)
+    positions = infos.start_idx[:, None] + npx.minimum(
+        steps[None, :], npx.maximum(seq_length - 1, 0)[:, None]
+    )
+    return PaddedSequence(
+        elements=data.elements.gather(positions),
+        mask=steps[None, :] < seq_length[:, None],
+        length=seq_length,
+        info=infos.info
+    )
+
+@struct(frozen=True)
+class BucketedStreamState:
+    offset: int
+    # the key from which the current epoch's order was drawn
+    epoch_key: jax.Array | None = None
+
+# Iterates over the batches of the buckets, which are scheduled
+# on the host. Only one kernel is compiled per bucket length.
+class BucketedStream(DataStream[PaddedSequence[T,I]]):
+    def __init__(self, builder: "BucketedStreamBuilder[T,I]",
+                 epoch_key: jax.Array | None, offset: int = 0):
+        self.builder = builder
+        self.epoch_key = epoch_key
+        self.offset = offset
+        self.schedule = builder.schedule(epoch_key)
+
+    def __len__(self):
+        return len(self.schedule) - self.offset
+
+    def has_next(self):
+        return self.offset < len(self.schedule)
+
+    def next(self) -> PaddedSequence[T,I]:
+        length, idxs = self.schedule[self.offset]
+        self.offset = self.offset + 1
+        return profile.stage("gather", _gather_padded, self.builder.data,
+            npx.array(idxs, dtype=idx_dtype), length)
+
+    def reset(self):
+        if self.epoch_key is not None:
+            self.epoch_key, _ = jax.random.split(self.epoch_key)
+        self.offset = 0
+        self.schedule = self.builder.schedule(self.epoch_key)
+
+    def state(self) -> BucketedStreamState:
+        return BucketedStreamState(self.offset, self.epoch_key)
+
+@struct(frozen=True)
+class BucketedStreamBuilder(StreamBuilder[PaddedSequence[T,I]]):
+    data: SequenceData[T,I]
+    buckets: tuple[int, ...]
+    batch_size: int | None = None
+    shuffle_key: jax.Array | None = None
+
+    def batch(self, batch_size: int) -> "BucketedStreamBuilder[T,I]":
+        if self.batch_size is not None:
+            raise ValueError("Bucketed streams only support a single batch axis")
+        return replace(self, batch_size=batch_size)
+
+    def shuffle(self, rng_key: jax.Array, resample=False, lazy=False) -> "BucketedStreamBuilder[T,I]":
+        if resample or lazy:
+            raise NotImplementedError("Bucketed streams only support plain shuffling")
+        return replace(self, shuffle_key=rng_key)
+
+    # The (bucket length, sequence indices) of every batch in an epoch.
+    # The last batch of a bucket is padded with -1 (empty rows).
+    def schedule(self, epoch_key: jax.Array | None = None) -> list[tuple[int, np.ndarray]]:
+        lengths = np.asarray(self.data.sequences.map(lambda x: x.length).as_pytree())
+        bucket_lengths = np.asarray(self.buckets)
+        assignment = np.minimum(
+            np.searchsorted(bucket_lengths, lengths, side="left"),
+            len(bucket_lengths) - 1
+        )
+        if epoch_key is not None:
+            bucket_key, order_key = jax.random.split(epoch_key)
+        batches = []
+        for b, bucket_length in enumerate(bucket_lengths):
+            idxs = np.nonzero(assignment == b)[0]
+            if epoch_key is not None:
+                idxs = idxs[np.asarray(jax.random.permutation(
+                    jax.random.fold_in(bucket_key, b), len(idxs)
+                ))]
+            for off in range(0, len(idxs), self.batch_size):
+                batch = np.full((self.batch_size,), -1, dtype=np.int64)
+                chunk = idxs[off:off + self.batch_size]
+                batch[:len(chunk)] = chunk
+                batches.append((int(bucket_length), batch))
+        if epoch_key is not None:
+            order = np.asarray(jax.random.permutation(order_key, len(batches)))
+            batches = [batches[i] for i in order]
+        return batches
+
+    @contextmanager
+    def build(self, resume_from: BucketedStreamState | None = None) -> Generator[DataStream[PaddedSequence[T,I]], None, None]:
+        if self.batch_size is None:
+            raise ValueError("Bucketed streams must be batched")
+        if resume_from is not None:
+            yield BucketedStream(self, resume_from.epoch_key, int(resume_from.offset))
+        else:
+            yield BucketedStream(self, self.shuffle_key)
+
+@struct(frozen=True)
+class PackedSequence(Generic[T]):
+    elements: T
+    segment_ids: jax.Array
+    positions: jax.Array
+
+    @property
+    def mask(self) -> jax.Array:
+        return self.segment_ids > 0
+
+# Rows of packed sequences, see SequenceData.pack().
+# Rows are computed on the fly from the sequence offsets.
+@struct(frozen=True)
+class PackedData(Data[PackedSequence[T]]):
+    elements: Data[T]
+    starts: jax.Array
+    # the offset of each sequence in the packed stream
+    cum_lengths: jax.Array
+    length: int
+
+    def __len__(self) -> int:
+        total = int(self.cum_lengths[-1])
+        return -(-total // self.length)
+
+    def __getitem__(self, idx) -> PackedSequence[T]:
+        idx = npx.asarray(idx, dtype=idx_dtype)
+        t = idx*self.length + npx.arange(self.length, dtype=idx_dtype)
+        valid = t < self.cum_lengths[-1]
+        seq = npx.clip(
+            npx.searchsorted(self.cum_lengths, t, side="right") - 1,
+            0, self.starts.shape[0] - 1
+        )
+        positions = npx.where(valid, t - self.cum_lengths[seq], 0)
+        elements = self.elements.gather(npx.where(valid, self.starts[seq] + positions, 0))
+        segment_ids = npx.where(valid, seq - seq[0] + 1, 0)
+        return PackedSequence(
+            elements=elements,
+            segment_ids=segment_ids.astype(npx.int32),
+            positions=positions.astype(npx.int32)
+        )
+
+    @property
+    def structure(self) -> PackedSequence[T]:
+        return PackedSequence(
+            elements=tree.map(
+                lambda s: jax.ShapeDtypeStruct((self.length,) + s.shape, s.dtype),
+                self.elements.structure
+            ),
+            segment_ids=jax.ShapeDtypeStruct((self.length,), npx.int32),
+            positions=jax.ShapeDtypeStruct((self.length,), npx.int32)
+        )
@@ -0,0 +1,140 @@
+from argon.data import DataStream, StreamBuilder
+from argon.struct import struct, replace
+from argon.typing import ArrayLike
+
+import argon.numpy as npx
+import argon.tree
+import argon.data.profile as profile
+
+from contextlib import contextmanager
+from typing import Any, Generator, TypeVar
+
+import functools
+import jax
+
+T = TypeVar('T')
+
+@functools.partial(jax.jit, donate_argnums=(0,))
+def _push(buffer : T, batch : T, fill : jax.Array) -> T:
+    return argon.tree.map(
+        lambda b, x: jax.lax.dynamic_update_slice_in_dim(b, x, fill, axis=0),
+        buffer, batch
+    )
+
+# Swap a batch with randomly chosen elements of a full buffer.
+@functools.partial(jax.jit, donate_argnums=(0,))
+def _swap(buffer : T, batch : T, rng_key : jax.Array) -> tuple[T, T, jax.Array]:
+    rng_key, sk = jax.random.split(rng_key)
+    capacity = argon.tree.axis_size(buffer)
+    n = argon.tree.axis_size(batch)
+    slots = jax.random.choice(sk, capacity, (n,), replace=False)
+    out = argon.tree.map(lambda b: b[slots], buffer)
+    buffer = argon.tree.map(lambda b, x: b.at[slots].set(x), buffer, batch)
+    return buffer, out, rng_key
+
+# Randomly permute the first fill elements of the buffer.
+@functools.partial(jax.jit, donate_argnums=(0,))
+def _permute(buffer : T, fill : jax.Array, rng_key : jax.Array) -> tuple[T, jax.Array]:
+    rng_key, sk = jax.random.split(rng_key)
+    capacity = argon.tree.axis_size(buffer)
+    r = jax.random.uniform(sk, (capacity,))
+    # keep the invalid elements at the end
+    r = npx.where(npx.arange(capacity) < fill, r, 2.)
+    order = npx.argsort(r)
+    return argon.tree.map(lambda b: b[order], buffer), rng_key
+
+@functools.partial(jax.jit, static_argnums=(2,))
+def _take(buffer : T, fill : jax.Array, n : int) -> T:
+    return argon.tree.map(
+        lambda b: jax.lax.dynamic_slice_in_dim(b, fill - n, n, axis=0), buffer
+    )
+
+# Approximately shuffles a (batched) stream by swapping each incoming
+# batch with random elements of a fixed-size, device-resident buffer.
+# Once the underlying stream is exhausted, the remaining buffer is
+# emitted in random order, so every element is output exactly once per epoch.
+class ShuffleBufferStream(DataStream[T]):
+    def __init__(self, stream: DataStream[T], size: int, rng_key: jax.Array):
+        if size < 1:
+            raise ValueError(f"Shuffle buffer size must be positive, got {size}")
+        self.stream = stream
+        self.size = size
+        self.rng_key = rng_key
+        self._buffer = None
+        self._batch_size = None
+        self._fill = 0
+        self._draining = False
+
+    # the remaining batches, including those held in the buffer
+    def __len__(self):
+        buffered = self._fill // self._batch_size if self._batch_size else 0
+        return len(self.stream) + buffered
+
+    def has_next(self):
+        return self._fill > 0 or self.stream.has_next()
+
+    def _allocate(self, batch: T):
+        n = self._batch_size = argon.tree.axis_size(batch)
+        # a whole number of batches, at least size elements
+        capacity = -(-self.size // n) * n
+        self._buffer = argon.tree.map(
+            lambda x: npx.zeros((capacity,) + x.shape[1:], x.dtype), batch
+        )
+
+    def _next(self) -> T:
+        while not self._draining and self.stream.has_next():
+            batch = self.stream.next()
+            if self._buffer is None:
+                self._allocate(batch)
+            n = argon.tree.axis_size(batch)
+            if self._fill < argon.tree.axis_size(self._buffer):
+                self._buffer = _push(self._buffer, batch, npx.asarray(self._fill))
+                self._fill += n
+                continue
+            self._buffer, out, self.rng_key = _swap(self._buffer, batch, self.rng_key)
+            return out
+        if self._fill == 0:
+            raise ValueError("Stream is exhausted, call reset()")
+        if not self._draining:
+            self._buffer, self.rng_key = _permute(
+                self._buffer, npx.asarray(self._fill), self.rng_key
+            )
+            self._draining = True
+        n = self._batch_size
+        out = _take(self._buffer, npx.asarray(self._fill), n)
+        self._fill -= n
+        if self._fill == 0:
+            self._draining = False
+        return out
+
+    def next(self) -> T:
+        return profile.stage("shuffle_buffer", self._next)
+
+    # Discards any buffered elements.
+    def reset(self):
+        self.stream.reset()
+        self._fill = 0
+        self._draining = False
+
+@struct(frozen=True)
+class ShuffleBufferStreamBuilder(StreamBuilder[T]):
+    builder: StreamBuilder[T]
+    size: int
+    rng_key: jax.Array
+
+    def batch(self, batch_size: int) -> "ShuffleBufferStreamBuilder[T]":
+        return replace(self, builder=self.builder.batch(batch_size))
+
+    def shuffle(self, rng_key : jax.Array, resample=False, lazy=False) -> "ShuffleBufferStreamBuilder[T]":
+        return replace(self, builder=self.builder.shuffle(rng_key, resample, lazy))
+
+    def weighted(self, weights : ArrayLike, rng_key : jax.Array | None = None) -> "ShuffleBufferStreamBuilder[T]":
+        return replace(self, builder=self.builder.weighted(weights, rng_key))
+
+    @contextmanager
+    def build(self, resume_from: Any = None) -> Generator[DataStream[T], None, None]:
+        # the buffered elements are not part of the state
+        if resume_from is not None:
+            raise ValueError("Cannot resume a stream with a shuffle buffer")
+        with self.builder.build() as stream:
+            yield ShuffleBufferStream(stream, self.size, self.rng_key)
@@ -3,7 +3,7 @@ import argon.transforms as agt
 
 from argon.typing import ShapeDtypeStruct
 from argon.struct import struct
-from argon.data import Data, io, PyTreeData, normalizer as nu
+from argon.data import Data, io, normalizer as nu
 from . import Image, ImageDataset
 
 from argon.datasets.common import DatasetRegistry
@@ -31,6 +31,19 @@ class FFHQData(Data):
             (self.resolution, self.resolution, 3), 
             method=jax.image.ResizeMethod.NEAREST)
         return Image(pixels)
+
+    @agt.jit
+    def gather(self, idxs) -> Image:
+        idxs = jnp.asarray(idxs)
+        pixels = io.read_images(
+            self.path + "/{:05d}.png",
+            (128, 128, 3),
+            idxs + self.start
+        )
+        pixels = jax.image.resize(pixels,
+            idxs.shape + (self.resolution, self.resolution, 3),
+            method=jax.image.ResizeMethod.NEAREST)
+        return Image(pixels)
     
     def __len__(self):
         return self.end - self.start
@@ -55,8 +68,6 @@ class FFHQDataset(ImageDataset):
         if name == "hypercube":
             pass
         elif name == "standard_dev":
-            data = agt.vmap(norm.normalize)(self.split("train").as_pytree())
-            normalizer = nu.StdNormalizer.from_data(PyTreeData(data))
             norm = nu.Chain([norm,
                 nu.StdNormalizer(
                     mean=jnp.array([0.5, 0.5, 0.5]),
@@ -82,7 +82,11 @@ class MnistDataset(ImageClassDataset):
         return None
 
 
-def _load_mnist(quiet=False, classes=None, **kwargs):
+# If placement is "host", the splits are kept in host memory
+# and only batches are transferred to the device.
+def _load_mnist(quiet=False, classes=None, placement="device", **kwargs):
+    if placement not in ("device", "host"):
+        raise ValueError(f"Unknown placement {placement}")
     classes = jnp.array(classes) if classes is not None else None
     with jax.default_device(jax.devices("cpu")[0]):
         data_path = cache_path("mnist")
@@ -117,25 +121,32 @@ def _load_mnist(quiet=False, classes=None, **kwargs):
             parse_labels(data_path / "t10k-labels-idx1-ubyte.gz")
         )
 
-        def filter(data : LabeledImage):
+        def filter(data : LabeledImage) -> Data[LabeledImage]:
+            data = PyTreeData(data)
             if classes is None:
                 return data
-            else:
-                mask = jax.vmap(lambda s: jnp.any(s.label == classes))(data)
-                filtered = LabeledImage(data.pixels[mask], data.label[mask])
-                # reindex the labels using the classes array
-                new_labels = jax.vmap(lambda l: jnp.argmax(classes == l))(filtered.label)
-                return LabeledImage(filtered.pixels, new_labels)
+            # a view of the matching images, with the labels
+            # reindexed using the classes array
+            return data.filter(
+                lambda s: jnp.any(s.label == classes)
+            ).map(
+                lambda s: LabeledImage(s.pixels, jnp.argmax(classes == s.label))
+            )
 
         train_data = filter(train_data)
         test_data = filter(test_data)
+        if placement == "host":
+            train_data = train_data.to_host()
+            test_data = test_data.to_host()
 
-        train_norm_images = (train_data.pixels.astype(jnp.float32) / 128.0) - 1
+        train_norm_images = (train_data.map(
+                lambda s: s.pixels
+            ).as_pytree().astype(jnp.float32) / 128.0) - 1
 
         return MnistDataset(
             _splits={
-                "train": PyTreeData(train_data),
-                "test": PyTreeData(test_data)
+                "train": train_data,
+                "test": test_data
             },
             _classes=[str(i) for i in range(10)] if classes is None else [str(i) for i in classes],
             _mean=jnp.mean(train_norm_images, axis=(0,)),
@@ -39,4 +39,47 @@ class PRNGSequence:
         return f"PRNGSequence({self._key})"
 
 def sequence(key_or_val : jax.Array) -> PRNGSequence:
-    return PRNGSequence(key_or_val)
\ No newline at end of file
+    return PRNGSequence(key_or_val)
+
+
+def _mix32(x):
+    # murmur3 finalizer
+    x = x ^ (x >> 16)
+    x = x * jax.numpy.uint32(0x85ebca6b)
+    x = x ^ (x >> 13)
+    x = x * jax.numpy.uint32(0xc2b2ae35)
+    x = x ^ (x >> 16)
+    return x
+
+def permutation_index(key : jax.Array, idx : jax.Array, n : int, *, rounds : int = 4) -> jax.Array:
+    """Computes the idx-th element of a pseudo-random permutation of range(n)
+    without materializing the permutation. For a fixed key, the map
+    idx -> permutation_index(key, idx, n) is a bijection on range(n).
+
+    This uses a balanced Feistel network over the smallest
+    power-of-two domain containing n, with cycle-walking to stay within range(n).
+    """
+    n = int(n)
+    if n < 1 or n > 2**32 - 1:
+        raise ValueError(f"Permutation size must be in [1, 2^32), got {n}")
+    bits = max(2, (n - 1).bit_length())
+    bits = bits + bits % 2
+    half = bits // 2
+    mask = jax.numpy.uint32((1 << half) - 1)
+    round_keys = jax.random.bits(key, (rounds,), jax.numpy.uint32)
+
+    def encrypt(x):
+        left, right = x >> half, x & mask
+        for r in range(rounds):
+            left, right = right, left ^ (_mix32(right ^ round_keys[r]) & mask)
+        return (left << half) | right
+
+    x = encrypt(jax.numpy.asarray(idx).astype(jax.numpy.uint32))
+    # Walk the cycle until we land back inside range(n).
+    # Since the domain is < 4n, this takes few iterations in expectation.
+    x = jax.lax.while_loop(
+        lambda x: jax.numpy.any(x >= n),
+        lambda x: jax.numpy.where(x >= n, encrypt(x), x),
+        x
+    )
+    return x
@@ -1,4 +1,4 @@
-from argon.data import DataStream, StreamBuilder
+from argon.data import DataStream, StreamBuilder, IndexedDataStream
 from argon.random import PRNGSequence
 from argon.typing import Array, ArrayLike, PRNGKey
 from argon.struct import struct
@@ -9,6 +9,7 @@ import argon.transforms as agt
 import argon.graph
 import argon.tree
 import argon.random
+import argon.data.profile
 
 from flax.nnx import Optimizer
 
@@ -49,9 +50,13 @@ class Loop(Generic[Sample]):
             max_iterations: int,
             trace_dir: str | None,
             progress: Progress,
-            show_epochs: bool):
+            show_epochs: bool,
+            fetch: bool = True):
         self.rng_key = rng_key
         self.data = data
+        # if False, steps do not fetch a batch (step.batch is None)
+        # and the caller is responsible for advancing the stream
+        self.fetch = fetch
         try: epoch_iterations = len(data)
         except TypeError: epoch_iterations = None
         self.epoch_iterations = epoch_iterations
@@ -126,7 +131,7 @@ class Epoch(Generic[Sample]):
                         data.reset()
                     if not data.has_next(): raise ValueError("Unable to reset stream!")
                     t = time.time()
-                    batch = data.next()
+                    batch = data.next() if self.loop.fetch else None
                     self.loop.data = data
                     sk = next(rng) if rng is not None else None
                 with jax.profiler.TraceAnnotation("run_step"):
@@ -167,8 +172,10 @@ class MofNColumn(ProgressColumn):
 def loop(data : StreamBuilder[Sample], *, 
          iterations, rng_key=None, 
          progress=True, show_epochs=True,
-         log_compiles=False, trace=False) -> Iterator[Loop[Sample]]:
-    with data.build() as stream:
+         log_compiles=False, trace=False,
+         resume_from=None, fetch=True) -> Iterator[Loop[Sample]]:
+    # resume_from is a loop.data.state() saved by a previous run
+    with data.build(resume_from) as stream:
         if progress:
             progress = Progress(
                 TextColumn("[progress.description]{task.description}"),
@@ -196,7 +203,8 @@ def loop(data : StreamBuilder[Sample], *,
             iterations,
             progress=progress,
             show_epochs=show_epochs,
-            trace_dir=trace_dir
+            trace_dir=trace_dir,
+            fetch=fetch
         )
         with progress_ctx, compile_logger:
             yield loop
@@ -228,7 +236,8 @@ class TrainStep(Step[Sample], Generic[Sample]):
                     graph_def: argon.graph.GraphDef, graph_state: argon.graph.GraphLeaves,
                     model: nn.Module, optimizer: Optimizer,
                     gradient: argon.graph.GraphLeaves | None = None,
-                    grad_variance: Array | None = None
+                    grad_variance: Array | None = None,
+                    stream: DataStream[Sample] | None = None
                  ):
         super().__init__(step.batch, step.rng_key, step.epoch, step.epoch_iteration, step.iteration)
         self.metrics = metrics
@@ -240,6 +249,12 @@ class TrainStep(Step[Sample], Generic[Sample]):
         self._graph_state = graph_state
         self._model = model
         self._optimizer = optimizer
+        self._stream = stream
+
+    # The data stream position after this step's batch,
+    # to be passed as resume_from when restarting training.
+    def data_state(self) -> Any:
+        return self._stream.state()
     
     def realize(self):
         argon.graph.update((self._model, self._optimizer), self._graph_state)
@@ -261,7 +276,15 @@ def train_model(data: StreamBuilder[Sample],
                 iterations: int, rng_key: PRNGKey | None = None,
                 store_gradient: bool = False,
                 store_gradient_variance: bool = False,
-                is_batch_loss: bool = False):
+                is_batch_loss: bool = False,
+                resume_from: Any = None,
+                profile: bool = False,
+                inline_data: bool = False):
+    # If profile, the data pipeline stages are instrumented
+    # and their statistics reported under sys_metrics["data"].
+    # If inline_data, the batch gather (and any fused maps)
+    # are compiled into the train step itself.
+    # This requires an indexed stream (e.g. from Data.stream()).
     # Set the model to training mode
     model.train()
     _loss = loss
@@ -301,6 +324,13 @@ def train_model(data: StreamBuilder[Sample],
         graphdef, state = argon.graph.split((model, optimizer))
         return graphdef, state, metrics, (grads if store_gradient else None), grad_variance
 
+    @agt.jit
+    def fetch_train_step(graphdef: argon.graph.GraphDef,
+             state: argon.graph.GraphLeaves,
+             rng_key: PRNGKey | None, stream: IndexedDataStream[Sample]):
+        batch = stream.fetch()
+        return batch, train_step(graphdef, state, rng_key, batch)
+
     t = time.time()
     def _time():
         nonlocal t
@@ -309,7 +339,13 @@ def train_model(data: StreamBuilder[Sample],
         t = nt
         return dt
     eval_time, data_load_time, opt_time = 0.,0.,0.
-    with loop(data, iterations=iterations, rng_key=rng_key) as l:
+    profiler = argon.data.profile.Profiler() if profile else None
+    profiling = (argon.data.profile.profiling(profiler)
+                 if profile else nullcontext())
+    with profiling, loop(data, iterations=iterations, rng_key=rng_key,
+              resume_from=resume_from, fetch=not inline_data) as l:
+        if inline_data and not isinstance(l.data, IndexedDataStream):
+            raise ValueError(f"inline_data requires an indexed stream, got {type(l.data).__name__}")
         for epoch in l.epochs():
             for step in epoch.steps():
                 sys_metrics = {
@@ -318,13 +354,21 @@ def train_model(data: StreamBuilder[Sample],
                     "eval_time": eval_time,
                     "step_time": data_load_time + opt_time + eval_time
                 }
+                if profiler is not None:
+                    sys_metrics["data"] = profiler.metrics()
                 data_load_time = _time()
-                graphdef, state, metrics, grads, grad_variance = train_step(
-                    graphdef, state, step.rng_key, step.batch
-                )
+                if inline_data:
+                    step.batch, (graphdef, state, metrics, grads, grad_variance) = fetch_train_step(
+                        graphdef, state, step.rng_key, l.data
+                    )
+                else:
+                    graphdef, state, metrics, grads, grad_variance = train_step(
+                        graphdef, state, step.rng_key, step.batch
+                    )
                 opt_time = _time()
                 tstep = TrainStep(step, metrics, sys_metrics,
-                        graphdef, state, model, optimizer, grads, grad_variance)
+                        graphdef, state, model, optimizer, grads, grad_variance,
+                        stream=l.data)
                 yield tstep
                 graphdef, state = tstep._graph_def, tstep._graph_state
                 eval_time = _time()
@@ -0,0 +1,539 @@
+from argon.data import PyTreeData, ConcatData, Mixture, IndexedStreamBuilder
+from argon.data.host import HostData, MmapData, TrajectoryData
+from argon.data.reduce import Covariance, Sum
+from argon.data.normalizer import StdNormalizer, PCANormalizer
+from argon.data.parallel import WorkerPool
+from argon.data.sequence import SequenceData
+
+import argon.numpy as npx
+import argon.random
+import numpy as np
+import chex
+import jax
+import os
+import pytest
+
+# SequenceData of the given trajectories, one after the other.
+def _sequences(trajectories):
+    sequences = SequenceData.from_trajectory(PyTreeData(trajectories[0]))
+    for trajectory in trajectories[1:]:
+        sequences = sequences.append(SequenceData.from_trajectory(PyTreeData(trajectory)))
+    return sequences
+
+def test_prefetch():
+    data = PyTreeData(npx.arange(10*8))
+    builder = data.stream().batch(8).shuffle(argon.random.key(42))
+    with builder.build() as stream:
+        expected = []
+        while stream.has_next():
+            expected.append(stream.next())
+    with builder.map(lambda x: 2*x).prefetch(2).build() as stream:
+        assert len(stream) == 10
+        batches = []
+        while stream.has_next():
+            batches.append(stream.next())
+        chex.assert_trees_all_equal(
+            npx.stack(batches), 2*npx.stack(expected)
+        )
+        stream.reset()
+        assert stream.has_next()
+        assert stream.next().shape == (8,)
+
+def test_gather():
+    data = PyTreeData({"a": npx.arange(10), "b": npx.ones((10, 3))})
+    mapped = data.map(lambda x: x["a"] + x["b"])
+    idxs = npx.array([[1, 2], [5, 9]])
+    chex.assert_trees_all_equal(data.gather(idxs)["a"], idxs)
+    chex.assert_trees_all_equal(mapped.gather(idxs), idxs[..., None] + npx.ones((2, 2, 3)))
+    chex.assert_trees_all_equal(mapped.as_pytree(), mapped.gather(npx.arange(10)))
+
+def test_mmap(tmp_path):
+    tree = {"a": np.arange(20, dtype=np.float32), "b": np.ones((20, 2), dtype=np.int32)}
+    MmapData.save(tmp_path, tree)
+    data = MmapData.load(tmp_path, tree)
+    assert len(data) == 20
+    assert data.structure["b"].shape == (2,)
+    sliced = data.slice(5, 10)
+    assert len(sliced) == 10
+    chex.assert_trees_all_equal(sliced.as_pytree()["a"], npx.arange(5, 15, dtype=npx.float32))
+    chex.assert_trees_all_equal(
+        sliced.gather(npx.array([[0, 9], [3, 3]]))["a"],
+        npx.array([[5., 14.], [8., 8.]])
+    )
+    # slicing past the end of a slice does not read beyond it
+    clamped = data.slice(0, 6).slice(4, 4)
+    assert len(clamped) == 2
+    chex.assert_trees_all_equal(clamped.as_pytree()["a"], npx.array([4., 5.]))
+    with sliced.stream().batch(5).shuffle(argon.random.key(42)).build() as stream:
+        batch = stream.next()
+    assert batch["b"].shape == (5, 2)
+
+def test_chunked_cache():
+    data = PyTreeData({"x": npx.arange(10), "y": npx.ones((10, 2))})
+    mapped = data.map(lambda x: x["x"][None] * x["y"])
+    expected = mapped.cache()
+    for chunk_size in (1, 3, 10, 16):
+        cached = mapped.cache(chunk_size=chunk_size)
+        chex.assert_trees_all_equal(cached.as_pytree(), expected.as_pytree())
+    cpu = jax.devices("cpu")[0]
+    cached = mapped.cache(chunk_size=4, device=cpu)
+    assert cached.as_pytree().devices() == {cpu}
+
+def test_memoize():
+    data = PyTreeData(npx.arange(16, dtype=npx.float32)).map(lambda x: 2*x)
+    # room for 8 float32 elements
+    memoized = data.memoize(max_bytes=8*4)
+    chex.assert_trees_all_equal(memoized.gather(npx.array([0, 1, 1, 2])), npx.array([0., 2., 2., 4.]))
+    assert memoized.stats()["misses"] == 3
+    assert memoized.stats()["hits"] == 1
+    chex.assert_trees_all_equal(memoized[1], npx.array(2.))
+    assert memoized.stats()["hits"] == 2
+    with memoized.stream().batch(4).build() as stream:
+        batches = []
+        while stream.has_next():
+            batches.append(stream.next())
+    chex.assert_trees_all_equal(npx.concatenate(batches), data.as_pytree())
+    assert memoized.stats()["entries"] == 8
+    assert memoized.stats()["evictions"] == 16 - 8
+
+def _host_fn(x):
+    return {"sum": np.sum(x), "sq": np.square(x)}
+
+def test_parallel_map():
+    data = PyTreeData(npx.arange(6*8*2, dtype=npx.float32).reshape(-1, 2))
+    with data.stream().batch(8).parallel_map(_host_fn, workers=3).build() as stream:
+        batches = []
+        while stream.has_next():
+            batches.append(stream.next())
+    assert len(batches) == 6
+    values = data.as_pytree()
+    chex.assert_trees_all_close(npx.concatenate([b["sq"] for b in batches]), npx.square(values))
+    chex.assert_trees_all_close(npx.concatenate([b["sum"] for b in batches]), npx.sum(values, -1))
+
+def _exit_fn(x):
+    os._exit(1)
+
+def test_parallel_map_worker_died():
+    structure = jax.ShapeDtypeStruct((2,), np.float32)
+    pool = WorkerPool(_exit_fn, workers=2, structure=structure)
+    try:
+        with pytest.raises(RuntimeError, match="died"):
+            pool(np.zeros((4, 2), np.float32))
+    finally:
+        pool.close()
+
+def test_lazy_shuffle():
+    for n in (1, 7, 64, 1000):
+        perm = argon.random.permutation_index(argon.random.key(3), npx.arange(n), n)
+        assert np.array_equal(np.sort(np.asarray(perm)), np.arange(n))
+    data = PyTreeData(npx.arange(48))
+    with data.stream().batch(8).shuffle(argon.random.key(42), lazy=True).build() as stream:
+        epochs = []
+        for _ in range(2):
+            batches = []
+            while stream.has_next():
+                batches.append(stream.next())
+            stream.reset()
+            epochs.append(np.concatenate(batches))
+    for epoch in epochs:
+        assert np.array_equal(np.sort(epoch), np.arange(48))
+    assert not np.array_equal(epochs[0], epochs[1])
+    assert not np.array_equal(epochs[0], np.arange(48))
+
+def test_weighted():
+    data = PyTreeData(npx.arange(1000) % 4)
+    weights = npx.tile(npx.array([0., 1., 2., 5.]), 250)
+    with data.stream().batch(1000).weighted(weights, argon.random.key(0)).build() as stream:
+        samples = np.concatenate([stream.next() for _ in range(8)])
+    freqs = np.bincount(samples, minlength=4) / samples.shape[0]
+    assert freqs[0] == 0
+    assert np.allclose(freqs, np.array([0., 1., 2., 5.]) / 8, atol=0.02)
+
+    sequences = SequenceData.from_pytree(npx.arange(12).reshape(3, 4))
+    chunks = sequences.chunk(2)
+    chunk_weights = chunks.chunk_weights(npx.array([1., 0., 1.]))
+    assert chunk_weights.shape == (len(chunks),)
+    assert np.all(np.asarray(chunk_weights)[3:6] == 0)
+
+def test_chunk():
+    sequences = _sequences([npx.arange(5)] + [10*l + npx.arange(l) for l in (1, 7, 3)])
+    for stride in (1, 2):
+        chunks = sequences.chunk(3, stride)
+        lazy = sequences.chunk(3, stride, lazy=True)
+        assert len(chunks) == len(lazy)
+        chex.assert_trees_all_equal(lazy.as_pytree(), chunks.as_pytree())
+        chex.assert_trees_all_equal(lazy.chunk_weights(npx.ones(4)), chunks.chunk_weights(npx.ones(4)))
+    chex.assert_trees_all_equal(chunks.as_pytree().elements[:3],
+        npx.array([[0, 1, 2], [2, 3, 4], [70, 71, 72]]))
+
+def test_trajectory_data(tmp_path):
+    sequences = _sequences([{"x": npx.arange(5), "y": npx.ones((5, 2))}] + [
+        {"x": 10*l + npx.arange(l), "y": npx.zeros((l, 2))} for l in (1, 7, 3)
+    ])
+    TrajectoryData.save(tmp_path / "data", sequences)
+    loaded = TrajectoryData.load(tmp_path / "data", cache_bytes=100)
+    assert isinstance(loaded.elements, TrajectoryData)
+    chex.assert_trees_all_equal(loaded.sequences.as_pytree(), sequences.sequences.as_pytree())
+    chex.assert_trees_all_equal(loaded.elements.as_pytree(), sequences.elements.as_pytree())
+    chex.assert_trees_all_equal(loaded.slice(2, 2)[1].as_pytree(), sequences[3].as_pytree())
+    chex.assert_trees_all_equal(loaded.chunk(3).as_pytree(), sequences.chunk(3).as_pytree())
+    stats = loaded.elements.stats()
+    assert stats["hits"] > 0 and stats["evictions"] > 0
+    assert stats["bytes"] <= 100
+
+def test_projection():
+    # a host array which must never be read
+    class Unreadable:
+        shape, dtype = (10, 3), np.float32
+        def __getitem__(self, idx):
+            raise AssertionError("Unused leaf was read")
+    data = HostData.from_arrays({"a": np.arange(10, dtype=np.int32), "b": Unreadable()})
+    # inferred from the mapped function
+    mapped = data.map(lambda x: 2*x["a"]).map(lambda x: x + 1)
+    chex.assert_trees_all_equal(mapped.as_pytree(), 2*npx.arange(10) + 1)
+    selected = data.select(["a"])
+    assert set(selected.structure.keys()) == {"a"}
+    chex.assert_trees_all_equal(selected.slice(2, 3).as_pytree(), {"a": npx.arange(2, 5)})
+    # slices are pushed into the children of a concatenation
+    concat = data.append(data)
+    assert isinstance(concat.slice(11, 5), HostData)
+    chex.assert_trees_all_equal(concat.slice(8, 4).select(["a"]).as_pytree(),
+        {"a": npx.array([8, 9, 0, 1])})
+
+_SCALE = 2.
+
+def _scaled(x):
+    return _SCALE * x
+
+def test_persist(tmp_path, monkeypatch):
+    import argon.data.host
+    computed = []
+    def map_chunked(data, fn, chunk_size):
+        computed.append(len(data))
+        return _map_chunked(data, fn, chunk_size)
+    _map_chunked = argon.data.host._map_chunked
+    monkeypatch.setattr(argon.data.host, "_map_chunked", map_chunked)
+
+    def expensive(x):
+        return {"x": 2*x, "y": npx.sin(x)}
+    data = PyTreeData(npx.arange(10, dtype=npx.float32))
+    persisted = data.map(expensive).persist(tmp_path / "data", key="v1", chunk_size=4)
+    chex.assert_trees_all_close(persisted.as_pytree(), data.map(expensive).as_pytree())
+    assert len(computed) == 1
+    # reopened rather than recomputed
+    again = data.map(expensive).persist(tmp_path / "data", key="v1", chunk_size=4)
+    assert len(computed) == 1
+    chex.assert_trees_all_close(again.as_pytree(), persisted.as_pytree())
+    # a different pipeline (or key) is recomputed
+    changed = data.map(lambda x: {"x": 3*x, "y": x}).persist(tmp_path / "data", key="v1")
+    chex.assert_trees_all_close(changed.as_pytree()["x"], 3*npx.arange(10))
+    data.map(expensive).persist(tmp_path / "data", key="v2")
+    assert len(computed) == 3
+    # as is one using a changed global
+    data.map(_scaled).persist(tmp_path / "scaled")
+    monkeypatch.setitem(globals(), "_SCALE", 3.)
+    data.map(_scaled).persist(tmp_path / "scaled")
+    assert len(computed) == 5
+    # and one of different source data, also if too large to hash in full
+    large = npx.arange(2**19, dtype=npx.float32)
+    PyTreeData(large).persist(tmp_path / "large")
+    PyTreeData(large).persist(tmp_path / "large")
+    assert len(computed) == 6
+    other = PyTreeData(large.at[-1].set(0.)).persist(tmp_path / "large")
+    assert len(computed) == 7
+    assert other[-1] == 0.
+
+def test_replay_buffer():
+    from argon.data.replay import ReplayBuffer
+    import argon.transforms as agt
+    structure = jax.ShapeDtypeStruct((2,), npx.float32)
+    buffer = ReplayBuffer.create(structure, capacity=4, sequence_capacity=2)
+    trajs = npx.arange(3*5*2, dtype=npx.float32).reshape(3, 5, 2)
+    # grows (by doubling) outside of jit
+    buffer = buffer.add_trajectories(trajs, lengths=npx.array([5, 2, 4]))
+    assert buffer.elements.capacity == 16 and buffer.sequences.capacity == 4
+    data = buffer.as_sequence_data()
+    assert len(data) == 3
+    chex.assert_trees_all_equal(data[1].as_pytree(), trajs[1, :2])
+    chex.assert_trees_all_equal(data[2].as_pytree(), trajs[2, :4])
+
+    # a ring buffer evicts the oldest trajectories, and can be added to under jit
+    ring = ReplayBuffer.create(structure, capacity=8, sequence_capacity=4, ring=True)
+    add = agt.jit(lambda b, t: b.add_trajectory(t))
+    for i in range(3):
+        ring = add(ring, trajs[i, :3] + 100*i)
+    data = ring.as_sequence_data()
+    assert len(data) == 2
+    chex.assert_trees_all_equal(data[0].as_pytree(), trajs[1, :3] + 100)
+    chex.assert_trees_all_equal(data[1].as_pytree(), trajs[2, :3] + 200)
+    samples = ring.sample(argon.random.key(0), (16,))
+    assert samples.shape == (16, 2)
+    assert npx.all(samples >= 100)
+
+    # under jit, trajectories which do not fit are dropped with their elements
+    small = ReplayBuffer.create(structure, capacity=4, sequence_capacity=4)
+    small = agt.jit(lambda b, t, l: b.add_trajectories(t, l))(
+        small, trajs, npx.array([2, 3, 1]))
+    assert len(small) == 1 and len(small.elements) == 2
+    # unless reserved beforehand
+    assert small.reserve(32, 8).elements.capacity == 32
+    # a ring buffer keeps the last capacity elements of a larger batch
+    ring = ReplayBuffer.create(structure, capacity=4, sequence_capacity=2, ring=True)
+    ring = ring.add_trajectory(trajs[0])
+    assert len(ring) == 0
+    chex.assert_trees_all_equal(ring.elements.as_pytree(), trajs[0, 1:])
+
+    # the storage is updated in place (donated), rather than copied
+    elements = buffer.elements
+    pointer = elements.buffer.unsafe_buffer_pointer()
+    elements = elements.add_batch(npx.ones((2, 2)))
+    assert buffer.elements.buffer.is_deleted()
+    assert elements.buffer.unsafe_buffer_pointer() == pointer
+
+def test_concat_mixture():
+    a = PyTreeData(npx.arange(5))
+    b = PyTreeData(10 + npx.arange(3)).map(lambda x: x)
+    data = a.append(b).append(a)
+    assert len(data) == 13
+    chex.assert_trees_all_equal(data.as_pytree(),
+        npx.array([0, 1, 2, 3, 4, 10, 11, 12, 0, 1, 2, 3, 4]))
+    chex.assert_trees_all_equal(data[6], npx.array(11))
+
+    # empty children are skipped
+    empty = PyTreeData(npx.zeros((0,), dtype=a.as_pytree().dtype))
+    assert len(a.append(empty).append(b).datas) == 2
+    chex.assert_trees_all_equal(ConcatData((empty, a, empty)).as_pytree(), npx.arange(5))
+
+    # host-backed children only read the rows they own
+    class Rows(np.ndarray):
+        reads = []
+        def __getitem__(self, idx):
+            Rows.reads.append(np.arange(self.shape[0])[idx])
+            return np.asarray(self)[idx]
+    rows = (20 + np.arange(4)).astype(np.asarray(a.as_pytree()).dtype).view(Rows)
+    host = HostData.from_arrays(rows)
+    for child, offset in ((host, 0), (host.map(lambda x: x + 1), 1)):
+        Rows.reads.clear()
+        chex.assert_trees_all_equal(a.append(child).gather(npx.array([6, 1, 8, 0])),
+                                    npx.array([21 + offset, 1, 23 + offset, 0]))
+        assert np.array_equal(np.concatenate(Rows.reads), [1, 3])
+
+    sequences = SequenceData.from_pytree(npx.arange(6).reshape(2, 3))
+    appended = sequences.append(sequences)
+    assert len(appended) == 4
+    chex.assert_trees_all_equal(appended[3].as_pytree(), npx.array([3, 4, 5]))
+
+    mixture = Mixture((a.stream(), PyTreeData(-npx.ones(20, dtype=npx.int32)).stream()), (1, 3))
+    with mixture.batch(4).shuffle(argon.random.key(0)).build() as stream:
+        assert len(stream) == 5
+        batch = stream.next()
+    assert batch.shape == (4,)
+    assert np.sum(np.asarray(batch) < 0) == 3
+
+def test_filter():
+    data = PyTreeData({"x": npx.arange(10), "y": npx.arange(10) % 3})
+    filtered = data.filter(lambda e: e["y"] == 0, chunk_size=4)
+    assert len(filtered) == 4
+    assert filtered.indices.dtype == npx.int32
+    chex.assert_trees_all_equal(filtered.as_pytree()["x"], npx.array([0, 3, 6, 9]))
+    # slicing past the end of the view is clamped
+    chex.assert_trees_all_equal(filtered.slice(2, 4).as_pytree()["x"], npx.array([6, 9]))
+    with filtered.stream().batch(2).shuffle(argon.random.key(1)).build() as stream:
+        batch = stream.next()
+    assert np.all(np.asarray(batch["y"]) == 0)
+
+    sequences = _sequences([npx.arange(5), npx.arange(2)])
+    chex.assert_trees_all_equal(sequences.truncate(3).as_pytree(), npx.array([[0, 1, 2]]))
+
+def test_reduce():
+    x = jax.random.normal(jax.random.key(0), (37, 3))
+    data = PyTreeData({"x": x, "i": npx.arange(37)})
+    for chunk_size in (1, 8, 37, 100):
+        stats = data.statistics(chunk_size=chunk_size)
+        assert stats.count == 37
+        chex.assert_trees_all_close(stats.mean["x"], npx.mean(x, axis=0), atol=1e-5)
+        chex.assert_trees_all_close(stats.var["x"], npx.var(x, axis=0), atol=1e-5)
+        chex.assert_trees_all_equal(stats.min["i"], npx.array(0))
+        chex.assert_trees_all_equal(stats.max["i"], npx.array(36))
+    chex.assert_trees_all_equal(data.reduce(Sum(), chunk_size=5)["i"], npx.sum(npx.arange(37)))
+    cov = data.map(lambda e: e["x"]).reduce(Covariance(), chunk_size=8)
+    chex.assert_trees_all_close(cov.cov, npx.cov(x, rowvar=False), atol=1e-5)
+    stream_sum = data.stream().batch(37).reduce(Sum())
+    chex.assert_trees_all_equal(stream_sum["i"], npx.sum(npx.arange(37)))
+
+    normalizer = StdNormalizer.from_data(PyTreeData(x), chunk_size=8)
+    chex.assert_trees_all_close(normalizer.std, npx.std(x, axis=0), atol=1e-5)
+    pca = PCANormalizer.from_data(PyTreeData(x), chunk_size=8)
+    assert pca.U.shape == (3, 3)
+
+def test_resume(tmp_path):
+    import argon.store
+    data = PyTreeData(npx.arange(40))
+    for lazy in (False, True):
+        builder = data.stream().batch(4).shuffle(argon.random.key(7), lazy=lazy).map(lambda x: 2*x)
+        with builder.build() as stream:
+            batches = [stream.next() for _ in range(10)]
+            stream.reset()
+            next_epoch = stream.next()
+        with builder.prefetch(3).build() as stream:
+            for _ in range(4):
+                stream.next()
+            state = stream.state()
+        argon.store.dump(state, tmp_path / f"state_{lazy}")
+        state = argon.store.load(tmp_path / f"state_{lazy}")
+        with builder.build(resume_from=state) as stream:
+            assert len(stream) == 6
+            resumed = [stream.next() for _ in range(6)]
+            assert not stream.has_next()
+            stream.reset()
+            chex.assert_trees_all_equal(stream.next(), next_epoch)
+        chex.assert_trees_all_equal(npx.stack(resumed), npx.stack(batches[4:]))
+
+def test_bucketed():
+    lengths = [1, 2, 3, 8, 9, 2, 7]
+    sequences = _sequences([npx.arange(l) for l in lengths])
+    builder = sequences.bucketed([3, 9]).batch(2).shuffle(argon.random.key(0))
+    with builder.build() as stream:
+        assert len(stream) == 4
+        seen = []
+        while stream.has_next():
+            batch = stream.next()
+            assert batch.elements.shape[1] in (3, 9)
+            assert batch.mask.shape == batch.elements.shape
+            for row, mask, length in zip(batch.elements, batch.mask, batch.length):
+                assert int(np.sum(mask)) == int(length)
+                if length > 0:
+                    chex.assert_trees_all_equal(row[mask], npx.arange(length))
+                    seen.append(int(length))
+    assert sorted(seen) == sorted(lengths)
+
+def test_pack():
+    sequences = _sequences([npx.arange(3)] + [10*l + npx.arange(l) for l in (4, 2)])
+    packed = sequences.pack(4)
+    assert len(packed) == 3
+    rows = packed.as_pytree()
+    chex.assert_trees_all_equal(rows.elements[:2], npx.array([[0, 1, 2, 40], [41, 42, 43, 20]]))
+    chex.assert_trees_all_equal(rows.segment_ids, npx.array([[1, 1, 1, 2], [1, 1, 1, 2], [1, 0, 0, 0]], dtype=npx.int32))
+    chex.assert_trees_all_equal(rows.positions, npx.array([[0, 1, 2, 0], [1, 2, 3, 0], [1, 0, 0, 0]], dtype=npx.int32))
+
+def test_fused_map():
+    data = PyTreeData(npx.arange(32, dtype=npx.float32))
+    builder = data.stream().batch(8).map(lambda x: 2*x).map(lambda x: x + 1)
+    # maps are fused into the indexed stream
+    assert isinstance(builder, IndexedStreamBuilder)
+    assert len(builder.transforms) == 2
+    with builder.build() as stream:
+        batches = []
+        while stream.has_next():
+            batches.append(stream.next())
+    assert npx.all(npx.concatenate(batches) == 2*npx.arange(32) + 1)
+    # multiple batch axes apply the map per element
+    with data.stream().batch(4).batch(2).map(lambda x: x[None]).build() as stream:
+        assert stream.next().shape == (2, 4, 1)
+
+def test_shuffle_buffer():
+    data = PyTreeData({"x": npx.arange(64), "y": npx.arange(64) % 3})
+    builder = data.stream().batch(8).shuffle_buffer(20, argon.random.key(42))
+    with builder.build() as stream:
+        assert len(stream) == 8
+        stream.next()
+        assert len(stream) == 7
+        stream.reset()
+        for _ in range(2):
+            batches = []
+            while stream.has_next():
+                batches.append(stream.next())
+            x = npx.concatenate([b["x"] for b in batches])
+            y = npx.concatenate([b["y"] for b in batches])
+            assert len(batches) == 8
+            # every element exactly once, in shuffled order
+            assert npx.all(npx.sort(x) == npx.arange(64))
+            assert not npx.all(x == npx.arange(64))
+            assert npx.all(y == x % 3)
+            stream.reset()
+
+def test_views():
+    data = PyTreeData({"x": npx.arange(10), "y": npx.ones((10, 2))})
+    view = data.slice(2, 6).slice(1, 3)
+    assert len(view) == 3
+    chex.assert_trees_all_equal(view.as_pytree()["x"], npx.array([3, 4, 5]))
+    # slicing past the end of a view does not read beyond it
+    clamped = data.slice(0, 6).slice(4, 4)
+    chex.assert_trees_all_equal(clamped.as_pytree()["x"], npx.array([4, 5]))
+    windows = data.slice(1, 8).window(3, stride=2)
+    assert len(windows) == 3
+    assert windows.structure["y"].shape == (3, 2)
+    chex.assert_trees_all_equal(windows.as_pytree()["x"], npx.array([[1, 2, 3], [3, 4, 5], [5, 6, 7]]))
+    chex.assert_trees_all_equal(windows.gather(npx.array([2]))["x"], npx.array([[5, 6, 7]]))
+
+    sequences = _sequences([npx.arange(3)] + [10*l + npx.arange(l) for l in (4, 2)])
+    tail = sequences.slice(1, 2)
+    assert len(tail) == 2
+    assert len(tail.elements) == 6
+    chex.assert_trees_all_equal(tail[1].as_pytree(), npx.array([20, 21]))
+    chex.assert_trees_all_equal(tail.sequences[1].end_idx, npx.array(6))
+    chex.assert_trees_all_equal(sequences.uniform_padded(3).as_pytree(),
+        npx.array([[0, 1, 2], [40, 41, 42], [20, 21, 21]]))
+    # streamed in order, i.e. sliced with a traced offset
+    for windows in (sequences.truncate(2), sequences.uniform_padded(3)):
+        with windows.stream().batch(2).build() as stream:
+            batches = [stream.next() for _ in range(len(stream))]
+        chex.assert_trees_all_equal(npx.concatenate(batches), windows.as_pytree()[:2])
+
+def test_to_host():
+    data = PyTreeData({"x": npx.arange(10), "y": npx.ones((10, 2))}).map(lambda e: e["x"] * e["y"])
+    for chunk_size in (None, 3):
+        host = data.to_host(chunk_size)
+        assert isinstance(host.arrays.tree, np.ndarray)
+        chex.assert_trees_all_equal(host.as_pytree(), data.as_pytree())
+    with host.stream().batch(4).shuffle(argon.random.key(0)).prefetch(2).build() as stream:
+        assert stream.next().shape == (4, 2)
+
+def test_compress():
+    x = jax.random.uniform(jax.random.key(0), (50, 3), minval=-2., maxval=5.)
+    traj = npx.cumsum(0.01 * jax.random.normal(jax.random.key(1), (50, 2)), axis=0)
+    data = PyTreeData({"x": x, "traj": traj, "label": npx.arange(50)})
+    compressed = data.compress({"x": "uint8", "traj": "float16", "label": None})
+    assert compressed.structure["x"].dtype == npx.float32
+    idxs = npx.array([[0, 7], [49, 3]])
+    batch = compressed.gather(idxs)
+    chex.assert_trees_all_equal(batch["label"], idxs)
+    chex.assert_trees_all_close(batch["x"], x[idxs], atol=7/255)
+    chex.assert_trees_all_close(batch["traj"], traj[idxs], atol=1e-3)
+
+    delta = PyTreeData(traj).compress("float16", delta_block=8)
+    chex.assert_trees_all_close(delta.as_pytree(), traj, atol=1e-4)
+    chex.assert_trees_all_close(delta[13], traj[13], atol=1e-4)
+    assert PyTreeData(x).compress().nbytes < x.nbytes / 3
+    with compressed.stream().batch(10).shuffle(argon.random.key(0)).build() as stream:
+        assert stream.next()["x"].shape == (10, 3)
+
+def test_profile():
+    import argon.data.profile
+    data = PyTreeData(npx.arange(64, dtype=npx.float32))
+    def double(x):
+        return 2*x
+    builder = data.stream().batch(8).map(double).prefetch(2)
+    with argon.data.profile.profiling() as profiler:
+        with builder.build() as stream:
+            while stream.has_next():
+                stream.next()
+    metrics = profiler.metrics()
+    for stage in ("gather", "map:double", "transfer", "prefetch_wait"):
+        assert stage in metrics
+    assert metrics["map:double"]["calls"] == 8
+    assert sum(metrics["gather"]["histogram"].values()) == 8
+    assert metrics["gather"]["bytes_per_s"] > 0
+
+def test_profile_record():
+    import argon.data.profile
+    import time
+    profiler = argon.data.profile.Profiler()
+    def read():
+        time.sleep(0.05)
+        profiler.record("read", 0.05)
+    profiler.run("gather", read)
+    metrics = profiler.metrics()
+    # the recorded time is not counted twice
+    assert metrics["read"]["latency"]["mean"] == 0.05
+    assert metrics["gather"]["latency"]["mean"] < 0.025
@@ -48,4 +48,31 @@ def test_train():
         # This will update the model, optimizer
         # but is costly and therefore should be avoided if possible
         step.realize()
-        pass
\ No newline at end of file
+        pass
+
+def test_train_inline_data():
+    data = PyTreeData(
+        {
+            "x": npx.arange(3*16, dtype=npx.float32)[:, None],
+            "y": npx.ones((3*16,1))
+         }
+    )
+    model = MLP(1, 1, [16, 16], rngs=nn.Rngs(42))
+    optimizer = nn.Optimizer(model, optax.adam(1e-3))
+
+    def loss(model, rng_key, sample):
+        pred = model(sample["x"])
+        loss = npx.mean((pred - sample["y"])**2)
+        return argon.train.LossOutput(
+            loss=loss, metrics={"mse": loss}
+        )
+
+    batches = []
+    for step in argon.train.train_model(
+                data.stream().batch(16).map(lambda s: {"x": s["x"] / 48, "y": s["y"]}),
+                model, optimizer, loss,
+                iterations=6, inline_data=True
+            ):
+        batches.append(step.batch["x"][0, 0])
+    # the stream still advances (and wraps around)
+    assert npx.allclose(npx.stack(batches), npx.array([0, 16, 32, 0, 16, 32]) / 48)
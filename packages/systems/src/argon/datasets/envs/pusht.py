@@ -2,6 +2,7 @@ from argon.struct import struct
 from argon.datasets.common import DatasetRegistry
 from argon.datasets.envs.common import EnvDataset, Step
 from argon.data import PyTreeData, idx_dtype
+from argon.data.host import TrajectoryData
 from argon.data.sequence import (
     SequenceInfo, SequenceData
 )
@@ -15,7 +16,6 @@ from argon.envs.pusht import (
 from argon.envs.mujoco import SystemState
 from argon.envs.common import ChainedTransform, MultiStepTransform
 
-import argon.store
 import jax
 import argon.numpy as jnp
 import zarr
@@ -95,7 +95,7 @@ def load_pytorch_pusht_data(zarr_path, max_trajectories=None):
 
 def load_chi_pusht_data(max_trajectories=None, quiet=False):
     zip_path = cache_path("pusht", "pusht_data_raw.zarr.zip")
-    processed_path = cache_path("pusht", "pusht_data.zarr.zip")
+    processed_path = cache_path("pusht", "pusht_trajectories.zarr")
     if not processed_path.exists():
         download(zip_path,
             job_name="PushT (Diffusion Policy Data)",
@@ -104,11 +104,12 @@ def load_chi_pusht_data(max_trajectories=None, quiet=False):
             quiet=quiet
         )
         data = load_pytorch_pusht_data(zip_path, max_trajectories)
-        argon.store.dump(data, processed_path)
+        TrajectoryData.save(processed_path, data)
         # remove the raw data
         zip_path.unlink()
-    data = argon.store.load(processed_path)
-    return data
+    # open the elements lazily (one zarr chunk per trajectory),
+    # only the (small) sequence infos are loaded into memory
+    return TrajectoryData.load(processed_path)
 
 def load_chi_pusht(quiet=False, train_trajs=None, test_trajs=10):
     data = load_chi_pusht_data()
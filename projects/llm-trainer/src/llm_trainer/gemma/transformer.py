@@ -26,6 +26,7 @@ from . import layers
 from . import modules
 from . import params as params_lib
 from . import sow_lib
+import jax
 import jax.numpy as jnp
 from argon.typing import Array
 
@@ -438,4 +439,42 @@ def build_positions_from_mask(input_mask: Array) -> Array:
   positions = jnp.cumsum(input_mask, axis=-1)
   # Subtract one for all positions from the first valid one as they are
   # 0-indexed
-  return positions - (positions >= 1)
\ No newline at end of file
+  return positions - (positions >= 1)
+
+
+def make_segment_causal_attn_mask(
+    segment_ids: Array,
+) -> Array:
+  """Attention mask for packed sequences in batch mode.
+
+  Args:
+    segment_ids: Segment ids of the tokens, where tokens of the same packed
+      sequence share an id. Padding tokens have segment id 0.
+
+  Returns:
+    Attention mask, where each token only attends to previous tokens of its
+    own segment.
+  """
+  seq_len = segment_ids.shape[-1]
+  same_segment = segment_ids[..., :, None] == segment_ids[..., None, :]
+  attn_mask = same_segment & (segment_ids[..., None, :] > 0)
+  causal_mask = jnp.tril(jnp.ones((seq_len, seq_len), dtype=jnp.bool_))
+  return attn_mask & causal_mask
+
+
+def build_positions_from_segments(segment_ids: Array) -> Array:
+  """Computes the `positions` of packed sequences from their `segment_ids`.
+
+  Args:
+    segment_ids: Segment ids of the tokens, 0 for padding tokens.
+
+  Returns:
+    The position of each token within its segment, 0 for padding tokens.
+  """
+  idxs = jnp.broadcast_to(jnp.arange(segment_ids.shape[-1]), segment_ids.shape)
+  previous = jnp.concatenate(
+      [jnp.full_like(segment_ids[..., :1], -1), segment_ids[..., :-1]], axis=-1
+  )
+  segment_starts = jnp.where(segment_ids != previous, idxs, 0)
+  positions = idxs - jax.lax.cummax(segment_starts, axis=segment_ids.ndim - 1)
+  return jnp.where(segment_ids > 0, positions, 0)
\ No newline at end of file
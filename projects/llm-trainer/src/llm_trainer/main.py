@@ -3,7 +3,7 @@ from .datasets import register as register_datasets
 
 from argon.registry import Registry
 from argon.struct import struct
-from argon.data import PyTreeData
+from argon.data.sequence import PackedSequence
 
 import argon.store.console
 import argon.store.comet
@@ -36,6 +36,8 @@ class Config:
     iterations: int
     dataset: str
     batch_size: int
+    # packed row length, 0 for the longest sequence
+    pack_length: int
 
     learning_rate : float
     weight_decay : float
@@ -46,6 +48,7 @@ class Config:
         cd.iterations = 10_000
         cd.dataset = "ops/add_mul_even"
         cd.batch_size = 16
+        cd.pack_length = 0
         cd.learning_rate = 3e-4
         cd.weight_decay = 1e-4
         return cd
@@ -57,6 +60,7 @@ class Config:
             iterations=opts.iterations,
             dataset=opts.dataset,
             batch_size=opts.batch_size,
+            pack_length=opts.pack_length,
             learning_rate=opts.learning_rate,
             weight_decay=opts.weight_decay
         )
@@ -78,8 +82,15 @@ def run():
     dataset = datasets.create(config.dataset)
 
     logger.info("Loading data...")
-    train = PyTreeData(dataset.split("train").as_pytree()[0])
-    test = PyTreeData(dataset.split("test").as_pytree()[0])
+    def load_split(name):
+        split = dataset.split(name)
+        pack_length = config.pack_length or int(npx.max(
+            split.sequences.map(lambda x: x.length).as_pytree()
+        ))
+        # concatenate the sequences into rows of pack_length tokens
+        return split.pack(pack_length).cache()
+    train = load_split("train")
+    test = load_split("test")
 
     logger.info("Creating model...")
     from .gemma.transformer import Transformer, TransformerConfig
@@ -106,19 +117,22 @@ def run():
     ))
 
     @agt.jit
-    def loss(model : Transformer, rng_key, sample):
+    def loss(model : Transformer, rng_key, sample : PackedSequence):
         # Add a batch axis to the sample
-        sample_batched = sample[None, ...]
-        input_mask = npx.ones(sample_batched.shape, dtype=npx.bool)
-        positions = transformerlib.build_positions_from_mask(input_mask)
-        attention_mask = transformerlib.make_causal_attn_mask(input_mask)
+        tokens = sample.elements[None, ...]
+        segment_ids = sample.segment_ids[None, ...]
+        # tokens only attend within their own sequence
+        attention_mask = transformerlib.make_segment_causal_attn_mask(segment_ids)
         outputs, _ = model(
-            sample_batched, positions, None, attention_mask
+            tokens, sample.positions[None, ...], None, attention_mask
         )
         output_logits = npx.squeeze(outputs, 0)
-        loss = optax.softmax_cross_entropy_with_integer_labels(
-            output_logits[:-1], sample[1:]
-        ).mean()
+        # do not predict across sequence boundaries or into padding
+        target_mask = (sample.segment_ids[1:] == sample.segment_ids[:-1]) & (sample.segment_ids[1:] > 0)
+        losses = optax.softmax_cross_entropy_with_integer_labels(
+            output_logits[:-1], sample.elements[1:]
+        )
+        loss = npx.sum(losses * target_mask) / npx.maximum(npx.sum(target_mask), 1)
         return argon.train.LossOutput(
             loss=loss,
             metrics={"loss": loss}
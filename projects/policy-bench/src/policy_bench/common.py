@@ -7,10 +7,11 @@ from argon.random import PRNGSequence
 from argon.envs.common import Environment, ObservationConfig
 
 from argon.datasets.common import DatasetRegistry
+from argon.datasets.util import cache_path
 from argon.datasets.envs.common import EnvDataset, Step
 from argon.datasets.envs import pusht as pusht_datasets
 
-from argon.struct import struct
+from argon.struct import struct, replace
 from argon.policy import Policy
 from argon.data import Data
 
@@ -39,6 +40,12 @@ class DataConfig:
     train_trajectories: int | None
     test_trajectories: int | None
     validation_trajectories: int | None
+    # store the processed data compressed,
+    # e.g. "uint8", "float16" or "bfloat16"
+    compression: str | None = None
+    # store the processed elements (full states) on disk,
+    # reused by later runs with the same data pipeline
+    persist: bool = False
 
     @staticmethod
     def default_dict() -> ConfigDict:
@@ -50,6 +57,8 @@ class DataConfig:
         cd.train_trajectories = None
         cd.test_trajectories = None
         cd.validation_trajectories = None
+        cd.compression = None
+        cd.persist = False
         return cd
 
     @staticmethod
@@ -61,15 +70,28 @@ class DataConfig:
             test_trajectories=dict.test_trajectories,
             validation_trajectories=dict.validation_trajectories,
             action_length=dict.action_length,
-            obs_length=dict.obs_length
+            obs_length=dict.obs_length,
+            compression=dict.get("compression", None),
+            persist=dict.get("persist", False)
         )
 
-    def _process_data(self, env : Environment, data):
+    def _process_data(self, env : Environment, data, split : str):
         def process_element(element : Step):
             if element.state is None: 
                 return (env.full_state(element.reduced_state), element.action)
             else: return (element.state, element.action)
-        data = data.map_elements(process_element).cache()
+        data = data.map_elements(process_element)
+        if self.persist:
+            # only the (expensive) full states are stored,
+            # the windowing below is cheap to redo
+            path = cache_path("policy-bench", f"{self.dataset}/{split}")
+            data = replace(data,
+                elements=data.elements.persist(path, key=(self.dataset, split))
+            )
+        # materialize in chunks, full states can be large
+        data = data.cache(chunk_size=1024)
+        if self.compression is not None:
+            data = data.compress(self.compression)
         data = data.chunk(
             self.action_length + self.obs_length - 1
         )
@@ -85,7 +107,7 @@ class DataConfig:
             )
         data = data.map(process_chunk)
         return data
-    
+
     def create_dataset(self) -> EnvDataset:
         datasets = DatasetRegistry[EnvDataset]()
         pusht_datasets.register(datasets)
@@ -99,14 +121,14 @@ class DataConfig:
             train_data = dataset.split("train")
             if self.train_trajectories is not None:
                 train_data = train_data.slice(0, self.train_trajectories)
-            train_data = self._process_data(env, train_data)
+            train_data = self._process_data(env, train_data, "train")
             loaded_splits["train"] = train_data
         if "test" in splits:
             logger.info(f"Loading test data from [blue]{self.dataset}[/blue]")
             test_data = dataset.split("test")
             if self.test_trajectories is not None:
                 test_data = test_data.slice(0, self.test_trajectories)
-            test_data = self._process_data(env, test_data)
+            test_data = self._process_data(env, test_data, "test")
             loaded_splits["test"] = test_data
         if "validation" in splits:
             logger.info(f"Loading validation data from [blue]{self.dataset}[/blue]")